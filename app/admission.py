@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from .exceptions import CustomExceptions
+from .hashing import HASHING_WORKERS, hashing_executor
+
+
+LOGIN_ADMISSION_ENABLED = os.getenv("LOGIN_ADMISSION_ENABLED", "true").lower() == "true"
+LOGIN_MAX_CONCURRENCY = int(os.getenv("LOGIN_MAX_CONCURRENCY", HASHING_WORKERS * 2))
+LOGIN_MAX_QUEUE = int(os.getenv("LOGIN_MAX_QUEUE", 64))
+LOGIN_QUEUE_TIMEOUT = float(os.getenv("LOGIN_QUEUE_TIMEOUT", 2.0))
+LOGIN_IP_RATE = float(os.getenv("LOGIN_IP_RATE", 10.0))
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", 50))
+LOGIN_USERNAME_RATE = float(os.getenv("LOGIN_USERNAME_RATE", 1.0))
+LOGIN_USERNAME_BURST = int(os.getenv("LOGIN_USERNAME_BURST", 10))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def wait(self, now: float):
+        """Seconds until a token is available, 0 if one is. Consumes nothing."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        """Consume one token. Returns 0 on success, otherwise seconds until one is available."""
+        wait = self.wait(now)
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class RateLimiter:
+    """Token buckets per key, keeping at most `max_keys` of the most recently used keys."""
+
+    def __init__(self, rate: float, capacity: int, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def take(self, key: str, now: float):
+        return self.bucket(key, now).take(now)
+
+
+class AdmissionController:
+    """
+    Admission control for /token: per-IP and per-username token buckets, a cap
+    on concurrent password verifications and a bounded wait queue. Requests
+    over a rate limit get a 429, requests that cannot get a verification slot
+    in time (or find the queue full) get a 503; both carry Retry-After.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = LOGIN_MAX_CONCURRENCY,
+                 max_queue: int = LOGIN_MAX_QUEUE,
+                 queue_timeout: float = LOGIN_QUEUE_TIMEOUT,
+                 ip_rate: float = LOGIN_IP_RATE,
+                 ip_burst: int = LOGIN_IP_BURST,
+                 username_rate: float = LOGIN_USERNAME_RATE,
+                 username_burst: int = LOGIN_USERNAME_BURST,
+                 enabled: bool = LOGIN_ADMISSION_ENABLED):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self.ip_limiter = RateLimiter(ip_rate, ip_burst)
+        self.username_limiter = RateLimiter(username_rate, username_burst)
+        self._in_flight = 0
+        self._waiters = deque()
+        self._rate_limited = 0
+        self._shed = 0
+
+    def _retry_after_overloaded(self):
+        average = hashing_executor.stats()["hash_seconds_avg"] or 1.0
+        return max(1, math.ceil((len(self._waiters) + 1) * average / self.max_concurrency))
+
+    def _check_rate_limits(self, client_ip: str, username: str):
+        # Only take from either bucket once both admit the attempt, so a
+        # rejected attempt does not use up the other bucket.
+        now = time.monotonic()
+        ip_bucket = self.ip_limiter.bucket(client_ip, now)
+        username_bucket = self.username_limiter.bucket(username.lower(), now)
+        wait = max(ip_bucket.wait(now), username_bucket.wait(now))
+        if wait:
+            self._rate_limited += 1
+            raise CustomExceptions.get_too_many_requests_exception(retry_after=math.ceil(wait))
+        ip_bucket.take(now)
+        username_bucket.take(now)
+
+    async def _acquire(self):
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed += 1
+            raise CustomExceptions.get_service_unavailable_exception(
+                retry_after=self._retry_after_overloaded())
+        slot = asyncio.get_running_loop().create_future()
+        self._waiters.append(slot)
+        try:
+            await asyncio.wait_for(asyncio.shield(slot), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if slot.done():
+                return
+            self._drop_waiter(slot)
+            self._shed += 1
+            raise CustomExceptions.get_service_unavailable_exception(
+                retry_after=self._retry_after_overloaded())
+        except BaseException:
+            if slot.done() and not slot.cancelled():
+                self._release()
+            else:
+                self._drop_waiter(slot)
+            raise
+
+    def _drop_waiter(self, slot):
+        slot.cancel()
+        with contextlib.suppress(ValueError):
+            self._waiters.remove(slot)
+
+    def _release(self):
+        while self._waiters:
+            slot = self._waiters.popleft()
+            if not slot.done():
+                # Hand the slot straight to the next waiter; in-flight count is unchanged.
+                slot.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @contextlib.asynccontextmanager
+    async def admit(self, client_ip: str, username: str):
+        if not self.enabled:
+            yield
+            return
+        self._check_rate_limits(client_ip, username)
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "rate_limited": self._rate_limited,
+            "shed": self._shed,
+        }
+
+
+login_admission = AdmissionController()
@@ -0,0 +1,26 @@
+"""Add users.permissions_version
+
+Revision ID: 45d9fbdcd4d6
+Revises: 220f893c50ea
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '45d9fbdcd4d6'
+down_revision: Union[str, None] = '220f893c50ea'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('permissions_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'permissions_version')
@@ -0,0 +1,30 @@
+"""Add api_counters
+
+Revision ID: 52887748b0ae
+Revises: eaf2d57cdf25
+Create Date: 2026-10-18 12:20:05.630911
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '52887748b0ae'
+down_revision: Union[str, None] = 'eaf2d57cdf25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('api_counters',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('value', sa.BigInteger(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('api_counters')
@@ -0,0 +1,58 @@
+"""
+One-off database bootstrap: creates the schema and seeds the default users
+and permissions when the users table is empty.
+
+It runs on application startup (unless BOOTSTRAP_ON_STARTUP=false) and can be
+run on its own with `python -m app.bootstrap`. Concurrent workers are
+serialized with a PostgreSQL advisory lock; on other databases a worker that
+loses the race hits the unique constraints and backs off.
+"""
+import logging
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .database import Base, engine as default_engine
+from .hashing import get_password_hash
+from .models import User, Permission, UserPermission
+
+
+BOOTSTRAP_LOCK_KEY = 0x5EED
+
+logger = logging.getLogger(__name__)
+
+
+def create_initial_data(db: Session):
+    if db.scalar(select(User.id).limit(1)) is not None:
+        return False
+    john = User(username="John", name="John", surname="Doe", email="john.doe@example.com", password=get_password_hash("G*qE/6r$"))
+    jane = User(username="Jane", name="Jane", surname="Doe", email="jane.doe@example.com", password=get_password_hash("G*qE/6r$"))
+    permission_admin = Permission(name="admin")
+    permission_guest = Permission(name="guest")
+    permission_user = Permission(name="user")
+    db.add_all([john, jane, permission_admin, permission_guest, permission_user])
+    db.flush()
+    db.add(UserPermission(user_id=john.id, permission_id=permission_admin.id))
+    db.add(UserPermission(user_id=jane.id, permission_id=permission_guest.id))
+    db.flush()
+    return True
+
+
+def bootstrap(engine=default_engine):
+    try:
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                connection.execute(select(func.pg_advisory_xact_lock(BOOTSTRAP_LOCK_KEY)))
+            Base.metadata.create_all(bind=connection)
+            with Session(bind=connection) as db:
+                seeded = create_initial_data(db)
+    except IntegrityError:
+        logger.info("Initial data already created by another worker")
+        return False
+    if seeded:
+        logger.info("Initial data created")
+    return seeded
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    bootstrap()
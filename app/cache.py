@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10_000))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 30))
+PERMISSION_VERSION_CACHE_SIZE = int(os.getenv("PERMISSION_VERSION_CACHE_SIZE", 10_000))
+PERMISSION_VERSION_TTL = float(os.getenv("PERMISSION_VERSION_TTL", 5))
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", 1_000))
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", 60))
+PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory")
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 1_000))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", 10))
+PAGE_CACHE_URL = os.getenv("PAGE_CACHE_URL", "redis://localhost:6379/0")
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Size-bounded LRU cache whose entries also expire after `ttl` seconds.
+    Meant to be used from the event loop thread, so it takes no locks.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        return self._entries.pop(key, None)
+
+    def pop(self, key):
+        entry = self._remove(key)
+        return entry[0] if entry else None
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ByteSizedLRUCache(LRUCache):
+    """LRUCache of bytes values that also keeps their total size under `max_bytes`."""
+
+    def __init__(self, maxsize: int, ttl: float, max_bytes: int):
+        super().__init__(maxsize, ttl)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    @staticmethod
+    def _size(key: str, value: bytes):
+        return len(key.encode()) + len(value)
+
+    def set(self, key, value: bytes, ttl: float = None):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        super().set(key, value, ttl)
+        if key in self._entries:
+            self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = super()._remove(key)
+        if entry is not None:
+            self.bytes -= self._size(key, entry[0])
+        return entry
+
+    def clear(self):
+        super().clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {**super().stats(), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+class PrincipalCache(LRUCache):
+    """
+    Resolved principals keyed by access token. Entries are tagged with a
+    per-username generation, so `invalidate_user` drops every cached token of
+    that user without having to index tokens by user. Generations are only
+    kept while some cached token of the user refers to them.
+
+    Invalidation is per worker: other workers keep their entries until the
+    TTL expires.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self._generations = {}
+        self._cached = Counter()
+        self._invalidations = 0
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        principal, generation = entry
+        if self._generations.get(principal.username, 0) != generation:
+            self.pop(key)
+            self.hits -= 1
+            self.misses += 1
+            return default
+        return principal
+
+    def generation(self) -> int:
+        """Take before reading a principal and pass to `set`, so a read that raced an invalidation is not cached."""
+        return self._invalidations
+
+    def set(self, key, value, ttl: float = None, generation: Optional[int] = None):
+        if generation is not None and generation != self._invalidations:
+            return
+        self._remove(key)
+        super().set(key, (value, self._generations.get(value.username, 0)), ttl)
+        if key in self._entries:
+            self._cached[value.username] += 1
+
+    def _remove(self, key):
+        entry = super()._remove(key)
+        if entry is not None:
+            username = entry[0][0].username
+            self._cached[username] -= 1
+            if not self._cached[username]:
+                del self._cached[username]
+                self._generations.pop(username, None)
+        return entry
+
+    def invalidate_user(self, username: str):
+        self._invalidations += 1
+        if username in self._cached:
+            self._generations[username] = self._generations.get(username, 0) + 1
+
+    def clear(self):
+        super().clear()
+        self._cached.clear()
+        self._generations.clear()
+
+
+class PermissionVersions(LRUCache):
+    """
+    users.permissions_version per user id, as last read from the database.
+    Entries expire after `ttl` seconds, so a permission change made through
+    any worker is seen by every other one within that time.
+    """
+
+    def __init__(self, maxsize: int = PERMISSION_VERSION_CACHE_SIZE, ttl: float = PERMISSION_VERSION_TTL):
+        super().__init__(maxsize, ttl)
+
+    def observe(self, user_id: int, version: int):
+        """Record `version`, just read from or written to the database."""
+        self.set(user_id, version)
+
+
+class Generation:
+    """
+    Counter bumped on every write to a table. Caches of derived results put it
+    in their keys, so a write makes every older entry unreachable at once.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def bump(self):
+        self.value += 1
+
+
+class MemoryPageBackend:
+    """Pages kept in this worker; other workers only see its writes after PAGE_CACHE_TTL."""
+
+    def __init__(self, maxsize: int = PAGE_CACHE_SIZE, ttl: float = PAGE_CACHE_TTL,
+                 max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.pages = ByteSizedLRUCache(maxsize, ttl, max_bytes)
+        self.ttl = ttl
+        self._generation = Generation()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.pages.get(key)
+
+    async def set(self, key: str, value: bytes):
+        self.pages.set(key, value)
+
+    async def generation(self) -> int:
+        return self._generation.value
+
+    async def bump(self):
+        self._generation.bump()
+
+    def clear(self):
+        self.pages.clear()
+
+    def stats(self):
+        stats = self.pages.stats()
+        return {"size": stats["size"], "bytes": stats["bytes"], "max_bytes": stats["max_bytes"]}
+
+
+class RedisPageBackend:
+    """
+    Pages and their generation stored in Redis, shared by every worker.
+    Needs the optional `redis` package.
+    """
+
+    GENERATION_KEY = "users:pages:generation"
+
+    def __init__(self, url: str = PAGE_CACHE_URL, ttl: float = PAGE_CACHE_TTL):
+        import redis.asyncio
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes):
+        await self.client.set(key, value, px=int(self.ttl * 1000))
+
+    async def generation(self) -> int:
+        return int(await self.client.get(self.GENERATION_KEY) or 0)
+
+    async def bump(self):
+        await self.client.incr(self.GENERATION_KEY)
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class PageCache:
+    """
+    Serialized /list_users/ pages keyed on the normalized filters and a users
+    generation that every user write bumps, so stale pages are never served.
+    A page is stored under the generation read before it was queried; a write
+    racing with the query only leaves an entry nobody will look up.
+    With a TTL of 0 no page is stored or looked up, but the generation is
+    still kept for the count cache.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.enabled = backend.ttl > 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(generation: int, name: Optional[str], surname: Optional[str], email: Optional[str],
+            skip: int, limit: int, after_id: Optional[int]):
+        filters = [(value or "").lower() for value in (name, surname, email)]
+        return f"users:page:{generation}:" + json.dumps([*filters, skip, limit, after_id])
+
+    async def generation(self) -> int:
+        return await self.backend.generation()
+
+    async def get(self, key: str):
+        """`(body, next_cursor)` of the cached page, or None."""
+        if not self.enabled:
+            return None
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        next_cursor, body = value.split(b"\n", 1)
+        return body, next_cursor.decode() or None
+
+    async def set(self, key: str, body: bytes, next_cursor: Optional[str]):
+        if not self.enabled:
+            return
+        await self.backend.set(key, (next_cursor or "").encode() + b"\n" + body)
+
+    async def invalidate(self):
+        await self.backend.bump()
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+def make_page_cache(backend: str = PAGE_CACHE_BACKEND, ttl: float = PAGE_CACHE_TTL):
+    if ttl < 0:
+        raise ValueError(f"PAGE_CACHE_TTL must be 0 (disabled) or positive, got {ttl}")
+    if ttl == 0:
+        logger.info("PAGE_CACHE_TTL is 0, /list_users/ pages are not cached")
+    if backend == "memory":
+        return PageCache(MemoryPageBackend(ttl=ttl))
+    if backend == "redis":
+        try:
+            return PageCache(RedisPageBackend(ttl=ttl))
+        except ImportError as error:
+            raise RuntimeError("PAGE_CACHE_BACKEND=redis needs the redis package: pip install redis") from error
+    raise ValueError(f"Unknown page cache backend: {backend}")
+
+
+principal_cache = PrincipalCache()
+permission_versions = PermissionVersions()
+count_cache = LRUCache(COUNT_CACHE_SIZE, COUNT_CACHE_TTL)
+page_cache = make_page_cache()
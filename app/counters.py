@@ -0,0 +1,103 @@
+"""
+Write-behind API counters. Increments only touch a per-worker dict (all
+callers run on the event loop, so no locks are needed); a background task
+periodically adds the accumulated deltas to the api_counters table with
+`UPDATE ... SET value = value + :delta`, so totals read from the table are
+shared by every worker and survive restarts.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+from collections import Counter
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from .database import AsyncSessionLocal
+from .models import ApiCounter
+
+
+COUNTERS_FLUSH_INTERVAL = float(os.getenv("COUNTERS_FLUSH_INTERVAL", 5))
+COUNTER_NAMES = ("create_user_calls", "list_users_calls", "background_ticks")
+
+logger = logging.getLogger(__name__)
+
+
+class ApiCounters:
+
+    def __init__(self, session_factory=AsyncSessionLocal, flush_interval: float = COUNTERS_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self._pending = Counter()
+        self._flushing = Counter()
+        self._local = Counter()
+        self._task = None
+
+    def increment(self, name: str, delta: int = 1):
+        self._pending[name] += delta
+        self._local[name] += delta
+
+    def local(self, name: str):
+        """Increments made by this worker since it started."""
+        return self._local[name]
+
+    async def flush(self):
+        if not self._pending:
+            return
+        self._flushing, self._pending = self._pending, Counter()
+        committed = False
+        try:
+            async with self.session_factory() as db:
+                for name, delta in self._flushing.items():
+                    result = await db.execute(
+                        update(ApiCounter).filter(ApiCounter.name == name).values(value=ApiCounter.value + delta)
+                    )
+                    if result.rowcount == 0:
+                        await self._insert_or_add(db, name, delta)
+                await db.commit()
+                # Clear before the session closes: totals() may run while it
+                # does and the table already holds these deltas.
+                self._flushing = Counter()
+                committed = True
+        except Exception:
+            logger.exception("Could not flush API counters, keeping them for the next flush")
+        finally:
+            # Also reached on cancellation (stop() cancelling a running flush),
+            # which `except Exception` does not catch.
+            if not committed:
+                self._pending.update(self._flushing)
+            self._flushing = Counter()
+
+    @staticmethod
+    async def _insert_or_add(db, name: str, delta: int):
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(ApiCounter).values(name=name, value=delta))
+        except IntegrityError:
+            await db.execute(update(ApiCounter).filter(ApiCounter.name == name).values(value=ApiCounter.value + delta))
+
+    async def totals(self, db):
+        """Totals across all workers: the table plus this worker's unflushed deltas."""
+        totals = Counter(dict((await db.execute(select(ApiCounter.name, ApiCounter.value))).all()))
+        totals.update(self._flushing)
+        totals.update(self._pending)
+        return {name: totals[name] for name in COUNTER_NAMES}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+
+api_counters = ApiCounters()
@@ -1,14 +1,205 @@
+import itertools
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import Select, create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from . import metrics
 
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_RETRY_INTERVAL = float(os.getenv("REPLICA_RETRY_INTERVAL", 30))
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(url: str):
+    """
+    Derive the async driver URL (asyncpg / aiosqlite) from a sync DATABASE_URL,
+    unless ASYNC_DATABASE_URL is set explicitly.
+    """
+    explicit_url = os.getenv("ASYNC_DATABASE_URL")
+    if explicit_url:
+        return explicit_url
+    return to_async_url(url)
+
+
+def to_async_url(url: str):
+    parsed_url = make_url(url)
+    backend = parsed_url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        return url
+    return parsed_url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(
+        hide_password=False
+    )
+
+
+class TimedCheckoutMixin:
+    """Records how long each checkout waits for a connection, and checkout timeouts."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            metrics.pool_timeouts.labels(self.logging_name).inc()
+            raise
+        finally:
+            metrics.pool_checkout_duration.labels(self.logging_name).observe(time.perf_counter() - started)
+
+
+class TimedQueuePool(TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, is_async: bool = False):
+    """Pool and timeout settings for `url`, taken from the DB_* environment variables."""
+    parsed_url = make_url(url)
+    backend = parsed_url.get_backend_name()
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if backend == "sqlite" and parsed_url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if backend == "postgresql" and DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def make_engine(url: str, name: str = "sync"):
+    engine = create_engine(url, pool_logging_name=name, **engine_options(url))
+    metrics.instrument_pool(engine, name)
+    return engine
+
+
+def make_async_engine(url: str, name: str = "async"):
+    engine = create_async_engine(url, pool_logging_name=name, **engine_options(url, is_async=True))
+    metrics.instrument_pool(engine.sync_engine, name)
+    metrics.instrument_engine(engine.sync_engine)
+    return engine
 
 
+class ReplicaSet:
+    """
+    Round-robin over the replica engines. A replica that fails to connect or
+    drops a connection is skipped for `retry_interval` seconds.
+    """
 
+    def __init__(self, engines: list, retry_interval: float = REPLICA_RETRY_INTERVAL):
+        self.engines = engines
+        self.sync_engines = {replica.sync_engine for replica in engines}
+        self.retry_interval = retry_interval
+        self._next = itertools.cycle(range(len(engines)))
+        self._down_until = {}
+        for replica in engines:
+            event.listen(replica.sync_engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self.mark_down(context.engine)
+
+    def is_healthy(self, replica) -> bool:
+        return self._down_until.get(replica.sync_engine, 0.0) <= time.monotonic()
+
+    def mark_down(self, sync_engine):
+        self._down_until[sync_engine] = time.monotonic() + self.retry_interval
+
+    def pick(self):
+        """The next healthy replica's sync engine, or None to use the primary."""
+        for _ in range(len(self.engines)):
+            replica = self.engines[next(self._next)]
+            if self.is_healthy(replica):
+                return replica.sync_engine
+        return None
+
+    def health(self):
+        return {(replica.sync_engine.pool.logging_name,): int(self.is_healthy(replica)) for replica in self.engines}
+
+    async def dispose(self):
+        for replica in self.engines:
+            await replica.dispose()
+
+
+def on_primary(statement):
+    """
+    Mark a read that must see writes committed through other sessions, such
+    as authentication and duplicate checks, so replica lag cannot affect it.
+    """
+    return statement.execution_options(use_primary=True)
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to one of `replicas` and everything else, including
+    reads marked with `on_primary`, to the primary. Once the session has
+    written, or asked for `use_primary()`, it stays on the primary so it
+    reads its own writes.
+    """
+
+    def __init__(self, *args, replicas: ReplicaSet = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def use_primary(self):
+        self.info["use_primary"] = True
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.replicas and not self.info.get("use_primary"):
+            if not isinstance(clause, Select) or clause._for_update_arg is not None or self._flushing:
+                self.use_primary()
+            elif not clause.get_execution_options().get("use_primary"):
+                replica = self.replicas.pick()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+    def _connection_for_bind(self, engine, execution_options=None, **kw):
+        if not self.replicas or engine not in self.replicas.sync_engines:
+            return super()._connection_for_bind(engine, execution_options, **kw)
+        try:
+            return super()._connection_for_bind(engine, execution_options, **kw)
+        except exc.DBAPIError:
+            self.replicas.mark_down(engine)
+            return super()._connection_for_bind(super().get_bind(), execution_options, **kw)
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = make_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL))
+replica_set = ReplicaSet([
+    make_async_engine(to_async_url(url), name=f"replica{index}")
+    for index, url in enumerate(DATABASE_REPLICA_URLS)
+])
+metrics.replica_healthy.add_callback(replica_set.health)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, sync_session_class=RoutingSession, replicas=replica_set, autoflush=False,
+    expire_on_commit=False
+)
+Base = declarative_base()
@@ -21,3 +21,27 @@ class CustomExceptions():
     @staticmethod
     def not_found_exception(detail="Not found"):
         return HTTPException(status_code=404, detail=detail)
+
+    @staticmethod
+    def get_too_many_requests_exception(retry_after: int, detail="Too many requests"):
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    @staticmethod
+    def get_service_unavailable_exception(retry_after: int, detail="Service temporarily overloaded"):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class DuplicateUserError(Exception):
+    """A username or email unique constraint rejected a user insert."""
+
+    def __init__(self, field: str):
+        super().__init__(f"{field.capitalize()} already registered")
+        self.field = field
@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import bcrypt
+from . import profiling
+from .metrics import bcrypt_duration
+
+
+HASHING_EXECUTOR = os.getenv("HASHING_EXECUTOR", "process")
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", os.cpu_count() or 1))
+
+
+def get_password_hash(password):
+    salt = bcrypt.gensalt()
+    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed_password.decode('utf-8')
+
+def verify_password(plain_password, hashed_password):
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def _timed_hash(password):
+    started = time.perf_counter()
+    return get_password_hash(password), time.perf_counter() - started
+
+def _timed_verify(plain_password, hashed_password):
+    started = time.perf_counter()
+    return verify_password(plain_password, hashed_password), time.perf_counter() - started
+
+
+class HashingExecutor:
+    """
+    Runs bcrypt off the event loop, by default in a process pool sized to the
+    machine's cores so login throughput scales with CPUs rather than with
+    uvicorn workers. `kind` is "process" or "thread".
+    """
+
+    def __init__(self, kind: str = HASHING_EXECUTOR, max_workers: int = HASHING_WORKERS):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown hashing executor: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._hash_seconds = 0.0
+        self._max_hash_seconds = 0.0
+        self._wait_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="hashing"
+                    )
+            return self._executor
+
+    async def _submit(self, operation, fn, *args):
+        executor = self._get_executor()
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            with profiling.timed("hash"):
+                result, hash_seconds = await asyncio.get_running_loop().run_in_executor(
+                    executor, fn, *args
+                )
+        finally:
+            self._in_flight -= 1
+        elapsed = time.perf_counter() - started
+        self._completed += 1
+        self._hash_seconds += hash_seconds
+        self._max_hash_seconds = max(self._max_hash_seconds, hash_seconds)
+        self._wait_seconds += max(0.0, elapsed - hash_seconds)
+        bcrypt_duration.labels(operation).observe(hash_seconds)
+        return result
+
+    async def hash_password(self, password: str) -> str:
+        return await self._submit("hash", _timed_hash, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit("verify", _timed_verify, plain_password, hashed_password)
+
+    def stats(self):
+        completed = self._completed
+        return {
+            "executor": self.kind,
+            "workers": self.max_workers,
+            "in_flight": self._in_flight,
+            "queue_depth": max(0, self._in_flight - self.max_workers),
+            "completed": completed,
+            "hash_seconds_total": round(self._hash_seconds, 6),
+            "hash_seconds_avg": round(self._hash_seconds / completed, 6) if completed else 0.0,
+            "hash_seconds_max": round(self._max_hash_seconds, 6),
+            "queue_wait_seconds_total": round(self._wait_seconds, 6),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hashing_executor = HashingExecutor()
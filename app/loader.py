@@ -0,0 +1,236 @@
+"""
+Bulk loader for the users and user_permissions tables.
+
+    python -m app.loader --csv users.csv
+    python -m app.loader --ndjson users.ndjson --batch-size 50000
+    python -m app.loader --synthetic 1000000 --permissions 2
+
+CSV files need a header with username, name, surname and email plus either
+password (hashed here, in parallel) or password_hash; an optional permissions
+column holds ";"-separated permission ids. NDJSON lines use the same keys,
+with permissions as a list. Synthetic users, and every user when
+--shared-password is given, share a single hash.
+
+On PostgreSQL ids are reserved from the users sequence and both tables are
+filled with COPY; other databases use executemany inserts. The non-unique
+users indexes are dropped during the load and rebuilt afterwards.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import func, insert, select, text
+from .database import Base, engine as default_engine
+from .hashing import HASHING_WORKERS, get_password_hash
+from .models import User, UserPermission
+
+
+LOADER_BATCH_SIZE = 10_000
+SHARED_PASSWORD = "G*qE/6r$"
+USER_COLUMNS = ("id", "username", "name", "surname", "email", "password", "permissions_version")
+
+logger = logging.getLogger(__name__)
+
+
+def read_csv(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            permissions = row.get("permissions") or ""
+            row["permissions"] = [int(value) for value in permissions.split(";") if value.strip()]
+            yield row
+
+
+def read_ndjson(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def synthetic_users(count: int, permissions: Iterable[int] = (), start: int = 0) -> Iterator[dict]:
+    """The users `benchmarks.harness.seed_users` has always generated: user{i}, Name{i % 1000}, ..."""
+    permissions = list(permissions)
+    for i in range(start, start + count):
+        yield {
+            "username": f"user{i}",
+            "name": f"Name{i % 1000}",
+            "surname": f"Surname{i % 5000}",
+            "email": f"user{i}@example.com",
+            "permissions": permissions,
+        }
+
+
+def _batches(rows: Iterable[dict], size: int):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def _hash_batch(batch: list, executor: Optional[ProcessPoolExecutor], shared_hash: Optional[str]):
+    """Fill in password_hash: the shared hash, or bcrypt of password in the process pool."""
+    pending = [row for row in batch if not row.get("password_hash")]
+    if shared_hash is not None:
+        for row in pending:
+            row["password_hash"] = shared_hash
+        return
+    if not pending:
+        return
+    if executor is None:
+        raise ValueError("Rows without password_hash need a password or --shared-password")
+    chunksize = max(1, len(pending) // (HASHING_WORKERS * 4))
+    hashes = executor.map(get_password_hash, [row["password"] for row in pending], chunksize=chunksize)
+    for row, password_hash in zip(pending, hashes):
+        row["password_hash"] = password_hash
+
+
+def _secondary_indexes():
+    return [index for index in User.__table__.indexes if not index.unique]
+
+
+def _copy(cursor, table: str, columns: tuple, rows: list):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _load_batch_copy(connection, batch: list):
+    ids = connection.execute(
+        select(func.nextval(func.pg_get_serial_sequence("users", "id"))).select_from(
+            func.generate_series(1, len(batch)))
+    ).scalars().all()
+    user_rows = [
+        (user_id, row["username"], row["name"], row["surname"], row["email"], row["password_hash"], 0)
+        for user_id, row in zip(ids, batch)
+    ]
+    permission_rows = [
+        (user_id, permission_id)
+        for user_id, row in zip(ids, batch)
+        for permission_id in dict.fromkeys(row.get("permissions") or ())
+    ]
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        _copy(cursor, "users", USER_COLUMNS, user_rows)
+        if permission_rows:
+            _copy(cursor, "user_permissions", ("user_id", "permission_id"), permission_rows)
+    finally:
+        cursor.close()
+    return len(permission_rows)
+
+
+def _load_batch_insert(connection, batch: list):
+    ids = connection.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        [
+            {"username": row["username"], "name": row["name"], "surname": row["surname"],
+             "email": row["email"], "password": row["password_hash"], "permissions_version": 0}
+            for row in batch
+        ],
+    ).scalars().all()
+    permission_rows = [
+        {"user_id": user_id, "permission_id": permission_id}
+        for user_id, row in zip(ids, batch)
+        for permission_id in dict.fromkeys(row.get("permissions") or ())
+    ]
+    if permission_rows:
+        connection.execute(insert(UserPermission), permission_rows)
+    return len(permission_rows)
+
+
+def _uses_copy(connection):
+    if connection.dialect.name != "postgresql":
+        return False
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        return hasattr(cursor, "copy_expert")
+    finally:
+        cursor.close()
+
+
+def load_users(rows: Iterable[dict], engine=default_engine, batch_size: int = LOADER_BATCH_SIZE,
+               shared_hash: Optional[str] = None, rebuild_indexes: bool = True):
+    """
+    Load `rows` in batches of `batch_size`, one transaction per batch, and
+    return counts and timings. Each row has username, name, surname, email,
+    optionally permissions, and password_hash or password.
+    """
+    Base.metadata.create_all(bind=engine)
+    stats = {"users": 0, "permissions": 0, "hash_seconds": 0.0, "load_seconds": 0.0, "index_seconds": 0.0}
+    started = time.perf_counter()
+    if rebuild_indexes:
+        with engine.begin() as connection:
+            for index in _secondary_indexes():
+                index.drop(connection, checkfirst=True)
+    executor = None
+    if shared_hash is None:
+        executor = ProcessPoolExecutor(max_workers=HASHING_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with engine.connect() as connection:
+            use_copy = _uses_copy(connection)
+        for batch in _batches(rows, batch_size):
+            hash_started = time.perf_counter()
+            _hash_batch(batch, executor, shared_hash)
+            stats["hash_seconds"] += time.perf_counter() - hash_started
+            load_started = time.perf_counter()
+            with engine.begin() as connection:
+                load_batch = _load_batch_copy if use_copy else _load_batch_insert
+                stats["permissions"] += load_batch(connection, batch)
+            stats["load_seconds"] += time.perf_counter() - load_started
+            stats["users"] += len(batch)
+            logger.info("Loaded %d users", stats["users"])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if rebuild_indexes:
+            index_started = time.perf_counter()
+            with engine.begin() as connection:
+                for index in _secondary_indexes():
+                    index.create(connection, checkfirst=True)
+                connection.execute(text("ANALYZE users"))
+                connection.execute(text("ANALYZE user_permissions"))
+            stats["index_seconds"] = time.perf_counter() - index_started
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_second"] = stats["users"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load users into the database.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="CSV file with a header row")
+    source.add_argument("--ndjson", help="file with one JSON user per line")
+    source.add_argument("--synthetic", type=int, help="number of synthetic users to generate")
+    parser.add_argument("--start", type=int, default=0, help="first synthetic user number")
+    parser.add_argument("--permissions", default="",
+                        help="comma-separated permission ids for synthetic users")
+    parser.add_argument("--shared-password", default=None,
+                        help="hash this password once and use it for every user")
+    parser.add_argument("--batch-size", type=int, default=LOADER_BATCH_SIZE)
+    parser.add_argument("--rebuild-indexes", action=argparse.BooleanOptionalAction, default=True)
+    args = parser.parse_args()
+
+    if args.csv:
+        rows = read_csv(args.csv)
+    elif args.ndjson:
+        rows = read_ndjson(args.ndjson)
+    else:
+        permissions = [int(value) for value in args.permissions.split(",") if value.strip()]
+        rows = synthetic_users(args.synthetic, permissions, args.start)
+        args.shared_password = args.shared_password or SHARED_PASSWORD
+    shared_hash = get_password_hash(args.shared_password) if args.shared_password else None
+    stats = load_users(rows, batch_size=args.batch_size, shared_hash=shared_hash,
+                       rebuild_indexes=args.rebuild_indexes)
+    print(f"loaded {stats['users']} users and {stats['permissions']} permissions in {stats['seconds']:.2f} s "
+          f"({stats['rows_per_second']:.0f} users/s; hashing {stats['hash_seconds']:.2f} s, "
+          f"loading {stats['load_seconds']:.2f} s, indexes {stats['index_seconds']:.2f} s)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
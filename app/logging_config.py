@@ -0,0 +1,147 @@
+"""
+Logging pipeline: request code only puts records on a bounded queue, and a
+QueueListener thread formats them and writes them to LOG_FILE, flushing once
+the queue is drained (or every LOG_BATCH_SIZE records) instead of per record.
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_FILE = os.getenv("LOG_FILE", "app/app.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+LOG_QUEUE_FULL_POLICY = os.getenv("LOG_QUEUE_FULL_POLICY", "drop")
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 256))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class BatchingFileHandler(logging.FileHandler):
+    """FileHandler that leaves flushing to the listener, or to every `batch_size` records."""
+
+    def __init__(self, filename: str, batch_size: int = LOG_BATCH_SIZE):
+        super().__init__(filename, mode="a", encoding="utf-8")
+        self.batch_size = batch_size
+        self._unflushed = 0
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        self._unflushed += 1
+        if self._unflushed >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        super().flush()
+        self._unflushed = 0
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full, or waits if `block` is set."""
+
+    def __init__(self, log_queue, block: bool = False):
+        super().__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener(QueueListener):
+
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+
+    def __init__(self, filename: str = LOG_FILE, level: str = LOG_LEVEL, log_format: str = LOG_FORMAT,
+                 queue_size: int = LOG_QUEUE_SIZE, policy: str = LOG_QUEUE_FULL_POLICY,
+                 batch_size: int = LOG_BATCH_SIZE):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown log queue policy: {policy}")
+        if log_format not in ("text", "json"):
+            raise ValueError(f"Unknown log format: {log_format}")
+        self.filename = filename
+        self.level = level
+        self.log_format = log_format
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue, block=policy == "block")
+        self.batch_size = batch_size
+        self._listener = None
+        self._logger = None
+
+    def _formatter(self):
+        if self.log_format == "json":
+            return JsonFormatter()
+        return logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    def start(self, logger: logging.Logger = None):
+        """Route `logger` (the root logger by default) through the queue."""
+        if self._listener is not None:
+            return
+        file_handler = BatchingFileHandler(self.filename, self.batch_size)
+        file_handler.setFormatter(self._formatter())
+        self._listener = BatchingQueueListener(self.queue, file_handler, respect_handler_level=True)
+        self._listener.start()
+        self._logger = logger or logging.getLogger()
+        self._logger.setLevel(self.level)
+        self._logger.addHandler(self.queue_handler)
+
+    def stop(self):
+        """Detach from the logger and write out everything still queued."""
+        if self._listener is None:
+            return
+        self._logger.removeHandler(self.queue_handler)
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+        self._listener = None
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+        }
+
+
+log_pipeline = LogPipeline()
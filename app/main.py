@@ -1,81 +1,109 @@
+import asyncio
 import logging
-import threading
-import time
+import os
 from typing import Optional
-from fastapi import FastAPI, Depends, Query
+from fastapi import FastAPI, Body, Depends, Query, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from . import models, schemas, service
-from .database import engine
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from . import admission, bootstrap, metrics, profiling, schemas, service
+from .database import AsyncSessionLocal, async_engine, replica_set
 from .repository import get_db
-from .exceptions import CustomExceptions
+from .cache import page_cache, principal_cache
+from .counters import api_counters
+from .exceptions import CustomExceptions, DuplicateUserError
+from .hashing import hashing_executor
+from .logging_config import log_pipeline
+from .revocation import revoked_tokens
 
 
 
-models.Base.metadata.create_all(bind=engine)
+BOOTSTRAP_ON_STARTUP = os.getenv("BOOTSTRAP_ON_STARTUP", "true").lower() == "true"
+BATCH_CREATE_MAX_SIZE = int(os.getenv("BATCH_CREATE_MAX_SIZE", 1_000))
+LIST_USERS_MAX_LIMIT = int(os.getenv("LIST_USERS_MAX_LIMIT", 1_000))
 
 app = FastAPI()
 
+
+async def is_admin_token(token: str):
+    async with AsyncSessionLocal() as db:
+        principal = await service.get_current_user(db, token)
+        return bool(principal) and await service.check_is_admin(db, principal)
+
+
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware, authorize=is_admin_token)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-create_user_counter = 0
-list_users_counter = 0
-background_counter = 0
+background_tasks = set()
 
 
-logging.basicConfig(filename="app/app.log",  
-    level=logging.INFO,  
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
-    datefmt="%Y-%m-%d %H:%M:%S", 
-    filemode='a')
 logger = logging.getLogger(__name__)
 
 
-def increment_background_counter():
-    global background_counter
+async def increment_background_counter():
     while True:
-        time.sleep(300)  
-        background_counter += 1
-        logging.info(f"Background counter incremented to {background_counter}")
+        await asyncio.sleep(300)
+        api_counters.increment("background_ticks")
+        logger.info("Background counter incremented to %s", api_counters.local("background_ticks"))
 
 
 @app.on_event("startup")
-def startup_event():
-    get_db()
-    threading.Thread(target=increment_background_counter, daemon=True).start()
-
-
-def increment_create_user_counter():
+async def startup_event():
+    log_pipeline.start()
+    if BOOTSTRAP_ON_STARTUP:
+        await run_in_threadpool(bootstrap.bootstrap)
+    api_counters.start()
+    await revoked_tokens.start()
+    metrics.registry.start()
+    background_tasks.add(asyncio.create_task(increment_background_counter()))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await api_counters.stop()
+    await revoked_tokens.stop()
+    await metrics.registry.stop()
+    await async_engine.dispose()
+    await replica_set.dispose()
+    hashing_executor.shutdown()
+    log_pipeline.stop()
+
+
+async def increment_create_user_counter():
     logger.info("POST /create_user")
-    global create_user_counter
-    create_user_counter += 1
+    api_counters.increment("create_user_calls")
 
 
-def increment_list_users_counter():
+async def increment_list_users_counter():
     logger.info("GET /list_users")
-    global list_users_counter
-    list_users_counter += 1
+    api_counters.increment("list_users_calls")
 
 
 @app.post("/create_user", 
           response_model=schemas.UserRead, 
           dependencies=[Depends(increment_create_user_counter)],
           tags=["users"])
-def create_user(user: schemas.UserCreate, token: str = Depends(oauth2_scheme),  db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, token: str = Depends(oauth2_scheme),  db: AsyncSession = Depends(get_db)):
     """
     Create a new user in the system.
 
     This endpoint allows an admin to create a new user. It verifies that the 
-    requester has admin privileges and checks if the provided email and username are 
-    already registered. If the checks pass, a new user is created in the database.
+    requester has admin privileges and then creates the user and its permissions in 
+    a single transaction. Already registered emails and usernames are rejected by 
+    the database's unique constraints, which also closes the check-then-insert race.
 
     Parameters:
     - user (schemas.UserCreate): The user data required to create a new user, 
       including username, email, name, surname, user level and a valid password.
     - token (str): The OAuth2 token for authentication, used to identify the 
       current user.
-    - db (Session): The database session for executing database operations.
+    - db (AsyncSession): The database session for executing database operations.
 
     Returns:
     - schemas.UserRead: The created user's information.
@@ -85,22 +113,62 @@ def create_user(user: schemas.UserCreate, token: str = Depends(oauth2_scheme),
     - HTTPException: If the email is already registered.
     - HTTPException: If the username is already registered.
     """
-    current_user = service.get_current_user(db, token)
+    current_user = await service.get_current_user(db, token)
+    if not current_user:
+        raise CustomExceptions.get_credentials_exception()
+    if not await service.check_is_admin(db, current_user):
+        raise CustomExceptions.get_not_authorized_exception()
+    try:
+        return await service.create_user(db=db, user=user)
+    except DuplicateUserError as error:
+        raise CustomExceptions.get_bad_request_exception(detail=str(error))
+
+
+@app.post("/create_users",
+          response_model=list[schemas.UserBatchResult],
+          tags=["users"])
+async def create_users(
+    users: list[schemas.UserCreate] = Body(max_length=BATCH_CREATE_MAX_SIZE),
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Create a batch of users in the system.
+
+    This endpoint allows an admin to create many users in one call. Duplicate 
+    usernames and emails are checked for the whole batch in one query, passwords 
+    are hashed in parallel and every accepted user is inserted, with its 
+    permissions, in a single transaction.
+
+    Parameters:
+    - users (list[schemas.UserCreate]): The users to create, at most 
+      BATCH_CREATE_MAX_SIZE (1000 by default).
+    - token (str): The OAuth2 token for authentication, used to identify the 
+      current user.
+    - db (AsyncSession): The database session for executing database operations.
+
+    Returns:
+    - list[schemas.UserBatchResult]: One result per submitted user, in order, holding 
+      either the created user or the reason it was rejected.
+
+    Raises:
+    - HTTPException: If the current user is not authenticated or not an admin.
+    - HTTPException: If a concurrent request registered one of the usernames or 
+      emails first; nothing from the batch is created in that case.
+    """
+    current_user = await service.get_current_user(db, token)
     if not current_user:
         raise CustomExceptions.get_credentials_exception()
-    if not service.check_is_admin(db, current_user):
+    if not await service.check_is_admin(db, current_user):
         raise CustomExceptions.get_not_authorized_exception()
-    db_user = service.get_user_by_email(db, email=user.email)
-    if db_user:
-        raise CustomExceptions.get_bad_request_exception(detail="Email already registered")
-    db_user = service.get_user(db, username=user.username)
-    if db_user:
-        raise CustomExceptions.get_bad_request_exception(detail="Username already registered")
-    return service.create_user(db=db, user=user)
+    try:
+        return await service.create_users(db, users)
+    except DuplicateUserError as error:
+        raise CustomExceptions.get_bad_request_exception(detail=str(error))
 
 
 @app.post("/token", response_model=schemas.Token, tags=["users"])
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     Authenticate a user and return an access token.
 
@@ -108,35 +176,75 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     If the credentials are valid, an access token is generated and returned for 
     subsequent authenticated requests.
 
+    Login attempts go through admission control: they are rate limited per client 
+    IP and per username, and the number of concurrent password verifications is 
+    capped, with a bounded wait queue.
+
     Parameters:
+    - request (Request): The incoming request, used to identify the client IP.
     - form_data (OAuth2PasswordRequestForm): The form data containing the username 
       and password for authentication.
-    - db (Session): The database session for executing database operations.
+    - db (AsyncSession): The database session for executing database operations.
 
     Returns:
     - schemas.Token: A dictionary containing the access token and its type (bearer).
 
     Raises:
     - HTTPException: If the credentials are invalid or the user cannot be authenticated.
+    - HTTPException: 429 with Retry-After if the client IP or username is over its rate limit.
+    - HTTPException: 503 with Retry-After if no verification slot frees up in time.
     """
-    user = service.authenticate_user(db, form_data.username, form_data.password)
+    client_ip = request.client.host if request.client else "unknown"
+    async with admission.login_admission.admit(client_ip, form_data.username):
+        user = await service.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise CustomExceptions.get_credentials_exception()
-    access_token = service.create_access_token(data={"sub": user.username})
+    access_token = service.create_access_token(data=await service.get_token_claims(db, user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.post("/logout", status_code=204, tags=["users"])
+async def logout(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """
+    Revoke the access token used to make this request.
+
+    The token's `jti` is stored in the revoked_tokens table and in this worker's 
+    in-memory revocation set, so the token is rejected here immediately and by 
+    the other workers after their next refresh (REVOCATION_REFRESH_INTERVAL, 5 
+    seconds by default).
+
+    Parameters:
+    - token (str): The OAuth2 token to revoke.
+    - db (AsyncSession): The database session for executing database operations.
+
+    Returns:
+    - Response: An empty 204 response.
+
+    Raises:
+    - HTTPException: If the token is invalid, expired or already revoked.
+    - HTTPException: If the token was issued without a `jti` and cannot be revoked.
+    """
+    current_user = await service.get_current_user(db, token)
+    if not current_user:
+        raise CustomExceptions.get_credentials_exception()
+    if not await service.revoke_token(db, token):
+        raise CustomExceptions.get_bad_request_exception(detail="Token cannot be revoked")
+    return Response(status_code=204)
+
+
 @app.get("/list_users/", 
          response_model=list[schemas.UserRead], 
          dependencies=[Depends(increment_list_users_counter)],
          tags=["users"])
-def list_users(
+async def list_users(
     skip: int = Query(0, ge=0),  
-    limit: int = Query(10, ge=1),  
+    limit: int = Query(10, ge=1, le=LIST_USERS_MAX_LIMIT),  
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     name: Optional[str] = None,
     surname: Optional[str] = None,
     email: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token: str = Depends(oauth2_scheme),
 ):
     """
@@ -146,13 +254,29 @@ def list_users(
     retrieve a paginated list of users. The list can be filtered based on optional 
     query parameters for name, surname, and email.
 
+    Users are returned ordered by id. When a page is full, the `X-Next-Cursor` 
+    response header carries an opaque cursor; passing it back as `cursor` returns 
+    the next page at constant cost regardless of depth. `skip` keeps working for 
+    offset pagination but cannot be combined with `cursor`.
+
+    With `include_total`, the `X-Total-Count` header carries the number of users 
+    matching the filters. Large totals are planner estimates, flagged by 
+    `X-Total-Count-Exact: false`.
+
+    Only the returned columns are selected, and the rows are encoded straight to 
+    JSON without validating them against `schemas.UserRead` a second time. Encoded 
+    pages are cached per filter combination until the next user is created.
+
     Parameters:
     - skip (int): The number of users to skip in the result set. Defaults to 0. Must be non-negative.
-    - limit (int): The maximum number of users to return. Defaults to 10. Must be at least 1.
+    - limit (int): The maximum number of users to return. Defaults to 10. Must be at least 1 
+      and at most LIST_USERS_MAX_LIMIT (1000 by default); use /export_users/ for bulk reads.
+    - cursor (Optional[str]): The `X-Next-Cursor` value of the previous page.
+    - include_total (bool): Whether to report the total number of matches in `X-Total-Count`.
     - name (Optional[str]): Filter users by their name.
     - surname (Optional[str]): Filter users by their surname.
     - email (Optional[str]): Filter users by their email address.
-    - db (Session): The database session for executing database operations.
+    - db (AsyncSession): The database session for executing database operations.
     - token (str): The OAuth2 token for authentication, used to identify the 
       current user.
 
@@ -161,19 +285,93 @@ def list_users(
 
     Raises:
     - HTTPException: If the current user is not authenticated or not authorized to access the user list.
+    - HTTPException: If the cursor is invalid or combined with skip.
+    """
+    current_user = await service.get_current_user(db, token) 
+    if not current_user:
+        raise CustomExceptions.get_credentials_exception()
+    if not await service.check_is_admin_or_user(db, current_user):
+        raise CustomExceptions.get_not_authorized_exception()
+    after_id = None
+    if cursor is not None:
+        if skip:
+            raise CustomExceptions.get_bad_request_exception(detail="skip cannot be combined with cursor")
+        try:
+            after_id = service.decode_cursor(cursor)
+        except ValueError:
+            raise CustomExceptions.get_bad_request_exception(detail="Invalid cursor")
+    generation = await page_cache.generation()
+    key = page_cache.key(generation, name, surname, email, skip, limit, after_id)
+    page = await page_cache.get(key)
+    if page is None:
+        query = service.filter_users(name, surname, email, after_id=after_id)
+        users = await service.list_users(db, query, skip, limit)
+        next_cursor = service.encode_cursor(users[-1].id) if len(users) == limit else None
+        page = service.encode_users(users), next_cursor
+        await page_cache.set(key, *page)
+    body, next_cursor = page
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if include_total:
+        total, exact = await service.count_users(db, name, surname, email)
+        headers["X-Total-Count"] = str(total)
+        headers["X-Total-Count-Exact"] = "true" if exact else "false"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/export_users/", response_class=StreamingResponse, tags=["users"])
+async def export_users(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    limit: Optional[int] = Query(None, ge=1),
+    name: Optional[str] = None,
+    surname: Optional[str] = None,
+    email: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(oauth2_scheme),
+):
+    """
+    Export the user directory as a stream of NDJSON lines or CSV rows.
+
+    This endpoint allows an authenticated user (with admin or user privileges) to 
+    download every user matching the optional name, surname and email filters. Rows 
+    are read with a server-side cursor and written out in chunks as they arrive, so 
+    memory use stays flat however many users are exported.
+
+    Parameters:
+    - export_format (str): The `format` query parameter, "ndjson" (default) or "csv".
+    - limit (Optional[int]): The maximum number of users to export. Defaults to all.
+    - name (Optional[str]): Filter users by their name.
+    - surname (Optional[str]): Filter users by their surname.
+    - email (Optional[str]): Filter users by their email address.
+    - db (AsyncSession): The database session for executing database operations.
+    - token (str): The OAuth2 token for authentication, used to identify the 
+      current user.
+
+    Returns:
+    - StreamingResponse: The matching users (id, username, name, surname, email), ordered by id.
+
+    Raises:
+    - HTTPException: If the current user is not authenticated or not authorized to export users.
     """
-    current_user = service.get_current_user(db, token) 
+    current_user = await service.get_current_user(db, token)
     if not current_user:
         raise CustomExceptions.get_credentials_exception()
-    if not service.check_is_admin_or_user(db, current_user):
+    if not await service.check_is_admin_or_user(db, current_user):
         raise CustomExceptions.get_not_authorized_exception()
-    query = service.filter_users(db, name, surname, email)
-    users = query.offset(skip).limit(limit).all()
-    return users
+    query = service.filter_users(name, surname, email)
+    if limit is not None:
+        query = query.limit(limit)
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        service.export_users(query, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=users.{export_format}"},
+    )
 
 
 @app.get("/counters/", response_model=dict, tags=["counters"])
-def get_counters(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_counters(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
     """
     Retrieve the counters for API call usage.
 
@@ -181,8 +379,11 @@ def get_counters(db: Session = Depends(get_db), token: str = Depends(oauth2_sche
     of times specific API calls have been made, such as user creation and user 
     listing. Access to this endpoint is restricted to users with admin privileges.
 
+    Counters are persisted in the database and shared by every worker; increments 
+    made by this worker since its last flush are included as well.
+
     Parameters:
-    - db (Session): The database session for executing database operations.
+    - db (AsyncSession): The database session for executing database operations.
     - token (str): The OAuth2 token for authentication, used to identify the 
       current user.
 
@@ -190,16 +391,48 @@ def get_counters(db: Session = Depends(get_db), token: str = Depends(oauth2_sche
     - dict: A dictionary containing counters for various API calls, including:
         - "create_user_calls": The number of times the create user endpoint has been called.
         - "list_users_calls": The number of times the list users endpoint has been called.
+        - "background_ticks": The number of background counter increments, across workers.
+        - "hashing": Password hashing executor metrics (queue depth, hashing time).
+        - "login_admission": Login admission control state and rejection counts.
+        - "principal_cache": Size, hits and misses of the authenticated principal cache.
+        - "page_cache": Hit ratio and memory footprint of the /list_users/ page cache.
+        - "revoked_tokens": Unexpired revoked tokens known to this worker.
+        - "logging": Records waiting to be written and records dropped on a full queue.
 
     Raises:
     - HTTPException: If the current user is not authenticated or not authorized.
     """
-    current_user = service.get_current_user(db, token)
+    current_user = await service.get_current_user(db, token)
     if not current_user:
         raise CustomExceptions.get_credentials_exception()
-    if not service.check_is_admin(db, current_user):
+    if not await service.check_is_admin(db, current_user):
         raise CustomExceptions.get_not_authorized_exception()
+    totals = await api_counters.totals(db)
     return JSONResponse(content={
-        "create_user_calls": create_user_counter,
-        "list_users_calls": list_users_counter
-    })
\ No newline at end of file
+        "create_user_calls": totals["create_user_calls"],
+        "list_users_calls": totals["list_users_calls"],
+        "background_ticks": totals["background_ticks"],
+        "hashing": hashing_executor.stats(),
+        "login_admission": admission.login_admission.stats(),
+        "principal_cache": principal_cache.stats(),
+        "page_cache": page_cache.stats(),
+        "revoked_tokens": revoked_tokens.stats(),
+        "logging": log_pipeline.stats(),
+    })
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["counters"])
+async def get_metrics():
+    """
+    Expose request, DB and bcrypt latency histograms for Prometheus.
+
+    Requests are counted per method, route template and status code. When 
+    METRICS_DIR is set, every worker periodically writes its series there and the 
+    response sums the series of all workers. The endpoint is not authenticated, 
+    like most scrape targets, so it should only be reachable from the monitoring 
+    network.
+
+    Returns:
+    - PlainTextResponse: The metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,332 @@
+"""
+Request latency, DB time, bcrypt time and connection pool metrics, rendered
+in the Prometheus text format. Observations only touch in-process dicts on the
+event loop thread; with several uvicorn workers each one periodically writes
+its snapshot to METRICS_DIR and a scrape sums every worker's file, leaving
+out the gauges of workers that have exited.
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import time
+from bisect import bisect_left
+from sqlalchemy import event
+from . import profiling
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BCRYPT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class HistogramFamily:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def labels(self, *values) -> Histogram:
+        histogram = self.series.get(values)
+        if histogram is None:
+            histogram = self.series[values] = Histogram(self.buckets)
+        return histogram
+
+    def snapshot(self):
+        return [[list(labels), histogram.counts, histogram.sum] for labels, histogram in self.series.items()]
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class CounterFamily:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.series = {}
+
+    def labels(self, *values) -> Counter:
+        counter = self.series.get(values)
+        if counter is None:
+            counter = self.series[values] = Counter()
+        return counter
+
+    def snapshot(self):
+        return [[list(labels), counter.value] for labels, counter in self.series.items()]
+
+
+class GaugeFamily:
+    """Gauge read at collection time from callbacks returning `{labels: value}`."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.callbacks = []
+        self.series = {}
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def snapshot(self):
+        values = {}
+        for callback in self.callbacks:
+            values.update(callback())
+        return [[list(labels), value] for labels, value in values.items()]
+
+
+class MetricsRegistry:
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL,
+                 enabled: bool = METRICS_ENABLED):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.families = {}
+        self._task = None
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        family = self.families[name] = HistogramFamily(name, documentation, label_names, buckets)
+        return family
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()):
+        family = self.families[name] = CounterFamily(name, documentation, label_names)
+        return family
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = ()):
+        family = self.families[name] = GaugeFamily(name, documentation, label_names)
+        return family
+
+    def clear(self):
+        for family in self.families.values():
+            family.series.clear()
+
+    def snapshot(self):
+        return {name: family.snapshot() for name, family in self.families.items()}
+
+    def _path(self, pid: int):
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def write_snapshot(self):
+        """Atomically replace this worker's file in METRICS_DIR."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f"{path}.tmp", path)
+
+    def _collect(self):
+        """
+        This worker's live series plus the last snapshot of every other worker.
+        Counters and histograms of exited workers still count towards the
+        totals; gauges only come from workers that are still running.
+        """
+        merged = {name: {tuple(series[0]): series[1:] for series in snapshot}
+                  for name, snapshot in self.snapshot().items()}
+        if not self.directory or not os.path.isdir(self.directory):
+            return merged
+        own = os.path.basename(self._path(os.getpid()))
+        for filename in os.listdir(self.directory):
+            if filename == own or not filename.startswith("metrics-") or not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(filename[len("metrics-"):-len(".json")])
+            for name, worker_series in snapshot.items():
+                if name not in merged or (not alive and self.families[name].kind == "gauge"):
+                    continue
+                for labels, *values in worker_series:
+                    key = tuple(labels)
+                    merged[name][key] = _add(merged[name][key], values) if key in merged[name] else values
+        return merged
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self._collect().items():
+            family = self.families[name]
+            lines.append(f"# HELP {name} {family.documentation}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for labels, values in sorted(series.items()):
+                label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(family.label_names, labels))
+                suffix = "{" + label_text + "}" if label_text else ""
+                if family.kind != "histogram":
+                    lines.append(f"{name}{suffix} {values[0]}")
+                    continue
+                counts, total = values
+                prefix = label_text + "," if label_text else ""
+                cumulative = 0
+                for bound, count in zip(family.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{suffix} {total}")
+                lines.append(f"{name}_count{suffix} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.write_snapshot()
+
+    def start(self):
+        if self.directory and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self.write_snapshot()
+
+
+def _add(values, other):
+    """Sum two snapshot entries: `[value]` or `[bucket counts, sum]`."""
+    return [[a + b for a, b in zip(value, other_value)] if isinstance(value, list) else value + other_value
+            for value, other_value in zip(values, other)]
+
+
+def _pid_alive(pid: str):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+request_duration = registry.histogram(
+    "app_http_request_duration_seconds", "Time spent serving HTTP requests.", ("method", "route", "status"))
+request_db_time = registry.histogram(
+    "app_http_request_db_seconds", "Time spent executing SQL statements per HTTP request.", ("method", "route"))
+bcrypt_duration = registry.histogram(
+    "app_bcrypt_duration_seconds", "Time spent in bcrypt per call.", ("operation",), BCRYPT_BUCKETS)
+pool_checkout_duration = registry.histogram(
+    "app_db_pool_checkout_seconds", "Time spent waiting for a pooled connection.", ("pool",))
+pool_overflow_checkouts = registry.counter(
+    "app_db_pool_overflow_checkouts_total", "Checkouts that needed an overflow connection.", ("pool",))
+pool_timeouts = registry.counter(
+    "app_db_pool_timeouts_total", "Checkouts that gave up after the pool timeout.", ("pool",))
+pool_checked_out = registry.gauge(
+    "app_db_pool_checked_out", "Connections currently checked out of the pool.", ("pool",))
+replica_healthy = registry.gauge(
+    "app_db_replica_healthy", "Whether a read replica is currently used (1) or skipped (0).", ("replica",))
+
+# Per-request accumulator for DB time; a mutable list so that cursor events,
+# which may run in a copied context, still add to the request's total.
+_db_time = contextvars.ContextVar("db_time", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    db_time = _db_time.get()
+    if db_time is not None:
+        db_time[0] += elapsed
+    profiling.record_statement(elapsed)
+
+
+def instrument_engine(engine):
+    """
+    Attribute statement execution time on `engine` (a sync Engine) to the
+    current request, for these metrics and for profiling's Server-Timing.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def instrument_pool(engine, name: str):
+    """Count overflow checkouts and report checked-out connections of `engine`'s pool."""
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool = engine.pool
+        if pool.checkedout() > pool.size():
+            pool_overflow_checkouts.labels(name).inc()
+
+    event.listen(engine, "checkout", on_checkout)
+    pool_checked_out.add_callback(lambda: {(name,): engine.pool.checkedout()})
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so it adds no task or body buffering to the request.
+    Routes are labelled by their path template to keep the series bounded.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        db_time = [0.0]
+        token = _db_time.set(db_time)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_time.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            request_duration.labels(method, path, str(status)).observe(elapsed)
+            request_db_time.labels(method, path).observe(db_time[0])
@@ -1,9 +1,13 @@
 from enum import Enum as PyEnum
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Enum, ForeignKey, DDL, Index, event
 from sqlalchemy.orm import relationship
 from .database import Base
 
 
+ADMIN_PERMISSION_ID = 1
+USER_PERMISSION_ID = 3
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -13,8 +17,23 @@ class User(Base):
     surname = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     password = Column(String)
+    permissions_version = Column(Integer, nullable=False, default=0, server_default="0")
     permissions = relationship("UserPermission", back_populates="user")
 
+    # Trigram GIN indexes serve the ILIKE '%term%' filters of /list_users/ on PostgreSQL.
+    __table_args__ = tuple(
+        Index(f"ix_users_{column}_trgm", column, postgresql_using="gin",
+              postgresql_ops={column: "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+        for column in ("name", "surname", "email")
+    )
+
+
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 
 class Permission(Base):
     __tablename__ = "permissions"
@@ -29,4 +48,19 @@ class UserPermission(Base):
     user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
     permission_id = Column(Integer, ForeignKey("permissions.id"), primary_key=True)
     user = relationship("User", back_populates="permissions")
-    permission = relationship("Permission", back_populates="users")
\ No newline at end of file
+    permission = relationship("Permission", back_populates="users")
+
+
+class ApiCounter(Base):
+    __tablename__ = "api_counters"
+
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String, unique=True, nullable=False)
+    expires_at = Column(BigInteger, nullable=False, index=True)
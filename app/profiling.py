@@ -0,0 +1,135 @@
+"""
+Opt-in request profiling. A sampled request (PROFILING_SAMPLE_RATE) gets a
+Server-Timing header splitting its time into DB statements, auth, password
+hashing and serialization. An admin sending the PROFILING_HEADER header also
+gets a cProfile dump of the request written to PROFILE_DIR.
+"""
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import os
+import random
+import re
+import time
+
+
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_HEADER = os.getenv("PROFILING_HEADER", "X-Profile")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+class RequestTimings:
+    __slots__ = ("phases", "db_count")
+
+    def __init__(self):
+        self.phases = {}
+        self.db_count = 0
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        entries = [f'db;dur={self.phases.get("db", 0.0) * 1000:.3f};desc="{self.db_count} statements"']
+        entries += [f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in self.phases.items() if phase != "db"]
+        entries.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(entries)
+
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextlib.contextmanager
+def timed(phase: str):
+    """Add the time spent in the block to `phase` of the current sampled request, if any."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+def record_statement(seconds: float):
+    """Count a statement towards the current sampled request, if any; called by metrics' cursor hooks."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.add("db", seconds)
+        timings.db_count += 1
+
+
+class ProfilingMiddleware:
+    """
+    `authorize(token)` decides whether the bearer of `token` may request a
+    cProfile dump. cProfile sees everything the event loop runs meanwhile, so
+    only one request is profiled at a time and concurrent ones show up in it.
+    """
+
+    def __init__(self, app, authorize, sample_rate: float = PROFILING_SAMPLE_RATE,
+                 header: str = PROFILING_HEADER, directory: str = PROFILE_DIR):
+        self.app = app
+        self.authorize = authorize
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode()
+        self.directory = directory
+        self._profiling = False
+
+    async def _wants_profile(self, scope):
+        headers = dict(scope["headers"])
+        if self.header not in headers or self._profiling:
+            return False
+        self._profiling = True
+        allowed = False
+        try:
+            scheme, _, token = headers.get(b"authorization", b"").decode().partition(" ")
+            allowed = scheme.lower() == "bearer" and await self.authorize(token)
+        finally:
+            self._profiling = allowed
+        return allowed
+
+    def _dump(self, profile: cProfile.Profile, scope):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        filename = f"{stamp}-{scope['method']}-{path}.prof"
+        profile.dump_stats(os.path.join(self.directory, filename))
+        return filename
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile = None
+        if await self._wants_profile(scope):
+            profile = cProfile.Profile()
+        elif not self.sample_rate or random.random() >= self.sample_rate:
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal profile
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing(time.perf_counter() - started).encode()))
+                if profile is not None:
+                    profile.disable()
+                    self._profiling = False
+                    headers.append((b"x-profile-file", self._dump(profile, scope).encode()))
+                    profile = None
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _timings.set(timings)
+        if profile is not None:
+            profile.enable()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            _timings.reset(token)
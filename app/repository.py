@@ -1,96 +1,223 @@
-import os
 from typing import Optional
-import bcrypt
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+import json
+from sqlalchemy import select, delete, insert, update, func, or_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import User, Permission, UserPermission
+from .database import AsyncSessionLocal, on_primary
+from .hashing import get_password_hash, verify_password, hashing_executor
+from .cache import page_cache, principal_cache, permission_versions
+from .exceptions import DuplicateUserError
 from . import schemas
 
 
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
-
-def get_password_hash(password):
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password.decode('utf-8')
-
-def verify_password(plain_password, hashed_password):
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def create_initial_data(db: Session):
-    if db.query(User).count() == 0:
-        john = User(username="John", name="John", surname="Doe", email="john.doe@example.com", password=get_password_hash("G*qE/6r$"))
-        jane = User(username="Jane", name="Jane", surname="Doe", email="jane.doe@example.com", password=get_password_hash("G*qE/6r$"))
-        db.add(john)
-        db.add(jane)
-        db.commit()
-        db.refresh(john)
-        db.refresh(jane)
-        permission_admin = Permission(name="admin")
-        permission_guest = Permission(name="guest")
-        permission_user = Permission(name="user")
-        db.add(permission_admin)  
-        db.add(permission_guest)
-        db.add(permission_user)
-        db.commit()
-        db.refresh(permission_admin)
-        db.refresh(permission_guest)
-        db.add(UserPermission(user_id=john.id, permission_id=permission_admin.id))
-        db.add(UserPermission(user_id=jane.id, permission_id=permission_guest.id))
-        db.commit() 
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        create_initial_data(db)
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
-
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
-    db_user = User(
-        username=user.username,
-        name=user.name,
-        surname=user.surname,
-        email=user.email,
-        password=hashed_password
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    """
+    Create one user and its permissions with INSERT ... RETURNING in a single
+    transaction. Duplicate usernames or emails are caught by the unique
+    constraints (raising DuplicateUserError) rather than checked beforehand.
+    """
+    hashed_password = await hashing_executor.hash_password(user.password)
+    created = await create_users(
+        db,
+        [{
+            "username": user.username,
+            "name": user.name,
+            "surname": user.surname,
+            "email": user.email,
+            "password": hashed_password,
+        }],
+        [list(dict.fromkeys(user.permissions))],
+    )
+    return created[0]
+
+async def find_registered(db: AsyncSession, usernames: list[str], emails: list[str]):
+    """Which of the given usernames and emails are already taken, in one query."""
+    rows = (await db.execute(on_primary(
+        select(User.username, User.email).filter(or_(User.username.in_(usernames), User.email.in_(emails)))
+    ))).all()
+    return {row.username for row in rows}, {row.email for row in rows}
+
+async def get_existing_permission_ids(db: AsyncSession, permission_ids: set[int]):
+    return set(await db.scalars(select(Permission.id).filter(Permission.id.in_(permission_ids))))
+
+async def insert_users(db: AsyncSession, users: list[dict], permissions: list[list[int]]):
+    """
+    Bulk INSERT ... RETURNING of `users` (column dicts, password already hashed)
+    and of their permission rows, without committing. Returns the new
+    (id, username, name, surname, email) rows in input order.
+    """
+    created = (await db.execute(
+        insert(User).returning(User.id, User.username, User.name, User.surname, User.email,
+                               sort_by_parameter_order=True),
+        users,
+    )).all()
+    permission_rows = [
+        {"user_id": row.id, "permission_id": permission_id}
+        for row, permission_ids in zip(created, permissions)
+        for permission_id in permission_ids
+    ]
+    if permission_rows:
+        await db.execute(insert(UserPermission), permission_rows)
+    return created
+
+UNIQUE_USER_CONSTRAINTS = {"ix_users_username": "username", "ix_users_email": "email"}
+
+def _constraint_name(error: IntegrityError):
+    """Violated constraint as reported by psycopg (`diag`) or asyncpg (the cause), if any."""
+    orig = error.orig
+    diag = getattr(orig, "diag", None)
+    return getattr(diag, "constraint_name", None) or getattr(orig.__cause__, "constraint_name", None)
+
+def _duplicate_user_field(error: IntegrityError):
+    constraint = _constraint_name(error)
+    if constraint is not None:
+        return UNIQUE_USER_CONSTRAINTS.get(constraint)
+    # SQLite only names the column: "UNIQUE constraint failed: users.email".
+    message = str(error.orig)
+    for field in ("email", "username"):
+        if f"users.{field}" in message:
+            return field
+    return None
+
+async def create_users(db: AsyncSession, users: list[dict], permissions: list[list[int]]):
+    """
+    Insert `users` and their permissions in a single transaction. A unique
+    violation on username or email rolls the whole batch back and surfaces as
+    DuplicateUserError.
+    """
+    try:
+        created = await insert_users(db, users, permissions)
+        await db.commit()
+    except IntegrityError as error:
+        await db.rollback()
+        field = _duplicate_user_field(error)
+        if field is None:
+            raise
+        raise DuplicateUserError(field) from error
+    await page_cache.invalidate()
+    return created
+
+async def get_user(db: AsyncSession, username: str):
+    return await db.scalar(on_primary(select(User).filter(User.username == username).limit(1)))
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(User).filter(User.email == email).limit(1))
+
+async def get_principal(db: AsyncSession, username: str):
+    rows = (await db.execute(on_primary(
+        select(User.id, User.username, User.permissions_version, UserPermission.permission_id)
+        .outerjoin(User.permissions)
+        .filter(User.username == username)
+    ))).all()
+    if not rows:
+        return None
+    return schemas.Principal(
+        id=rows[0].id,
+        username=rows[0].username,
+        permissions_version=rows[0].permissions_version,
+        permissions={row.permission_id for row in rows if row.permission_id is not None},
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    new_user = get_user(db, username = user.username)
-    for permission_id in user.permissions:
-        db.add(UserPermission(user_id=new_user.id, permission_id=permission_id))
-    db.commit()
-    return db_user
 
-def get_user(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_permissions_version(db: AsyncSession, user_id: int):
+    return await db.scalar(on_primary(select(User.permissions_version).filter(User.id == user_id)))
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def get_user_permission_ids(db: AsyncSession, user_id: int):
+    return set(await db.scalars(on_primary(
+        select(UserPermission.permission_id).filter(UserPermission.user_id == user_id))))
 
-def check_is_admin(db: Session, user: schemas.UserCheckPermisions):
-    return db.query(UserPermission).filter(UserPermission.user_id == user.id, UserPermission.permission_id == 1).first()
+async def set_user_permissions(db: AsyncSession, user: User, permission_ids: list[int]):
+    await db.execute(delete(UserPermission).filter(UserPermission.user_id == user.id))
+    for permission_id in permission_ids:
+        db.add(UserPermission(user_id=user.id, permission_id=permission_id))
+    version = await db.scalar(
+        update(User)
+        .filter(User.id == user.id)
+        .values(permissions_version=User.permissions_version + 1)
+        .returning(User.permissions_version)
+    )
+    await db.commit()
+    permission_versions.observe(user.id, version)
+    principal_cache.invalidate_user(user.username)
+    return version
 
-def check_is_admin_or_user(db: Session, user: schemas.UserCheckPermisions):
-    return db.query(UserPermission).filter(UserPermission.user_id == user.id, UserPermission.permission_id.in_([1, 3])).first()
+def contains_ignore_case(column, term: str):
+    """
+    Case-insensitive substring match as `column ILIKE '%term%'`, which the
+    trigram GIN indexes on PostgreSQL serve. LIKE wildcards in `term` are
+    escaped so user input always matches literally.
+    """
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return column.ilike(f"%{escaped}%", escape="\\")
 
-def filter_users(db: Session,
-    name: Optional[str] = None,
+def filter_users(name: Optional[str] = None,
     surname: Optional[str] = None,
-    email: Optional[str] = None):
-    query = db.query(User)
+    email: Optional[str] = None,
+    after_id: Optional[int] = None):
+    query = select(User).order_by(User.id)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
     if name:
-        query = query.filter(User.name.ilike(f"%{name}%"))
+        query = query.filter(contains_ignore_case(User.name, name))
     if surname:
-        query = query.filter(User.surname.ilike(f"%{surname}%"))
+        query = query.filter(contains_ignore_case(User.surname, surname))
     if email:
-        query = query.filter(User.email.ilike(f"%{email}%"))
-    return query
\ No newline at end of file
+        query = query.filter(contains_ignore_case(User.email, email))
+    return query
+
+def user_read_columns(query):
+    """Narrow a `filter_users` query to the public (id, username, name, surname, email) columns."""
+    return query.with_only_columns(User.id, User.username, User.name, User.surname, User.email)
+
+async def list_user_rows(db: AsyncSession, query, offset: int, limit: int):
+    """Plain rows rather than User entities, so nothing goes through the identity map."""
+    return (await db.execute(user_read_columns(query).offset(offset).limit(limit))).all()
+
+async def stream_user_rows(query, chunk_size: int):
+    """
+    Yield lists of up to `chunk_size` (id, username, name, surname, email) rows
+    of `query`, fetched through a server-side cursor on a dedicated session so
+    the stream can outlive the request's own session.
+    """
+    query = user_read_columns(query)
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions():
+            yield rows
+
+async def count_rows(db: AsyncSession, query, limit: Optional[int] = None):
+    """Exact row count of `query`, counting at most `limit` rows when given."""
+    query = query.order_by(None)
+    if limit is not None:
+        query = query.limit(limit)
+    return await db.scalar(select(func.count()).select_from(query.subquery()))
+
+class Explain(Executable, ClauseElement):
+    """`EXPLAIN (FORMAT JSON) <statement>`, with the statement's parameters bound as usual."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+async def estimate_rows(db: AsyncSession, query):
+    """
+    Row estimate from the PostgreSQL planner statistics, or None on databases
+    without them.
+    """
+    if db.bind.dialect.name != "postgresql":
+        return None
+    plan = (await db.execute(Explain(query.order_by(None)))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
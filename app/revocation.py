@@ -0,0 +1,115 @@
+"""
+Revoked access tokens. Revocations are stored in the revoked_tokens table by
+jti; every worker mirrors the unexpired ones in a set, refreshed from the
+table every REVOCATION_REFRESH_INTERVAL seconds, so checking a token is a set
+lookup and never a query. Expired revocations are pruned in the background.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from typing import Optional
+from jose import JWTError, jwt
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from .database import AsyncSessionLocal, on_primary
+from .models import RevokedToken
+
+
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("REVOCATION_REFRESH_INTERVAL", 5))
+REVOCATION_PRUNE_INTERVAL = float(os.getenv("REVOCATION_PRUNE_INTERVAL", 600))
+# Ids are assigned before commit, so a refresh can see id N+1 before id N has
+# committed. Re-reading the last few ids picks such late commits up.
+REVOCATION_REFRESH_OVERLAP = 1_000
+
+logger = logging.getLogger(__name__)
+
+
+def token_jti(token: str) -> Optional[str]:
+    """The jti claim of `token`, without verifying it."""
+    try:
+        return jwt.get_unverified_claims(token).get("jti")
+    except JWTError:
+        return None
+
+
+class RevocationList:
+
+    def __init__(self, session_factory=AsyncSessionLocal, refresh_interval: float = REVOCATION_REFRESH_INTERVAL,
+                 prune_interval: float = REVOCATION_PRUNE_INTERVAL):
+        self.session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.prune_interval = prune_interval
+        self._revoked = {}
+        self._last_id = 0
+        self._last_prune = time.monotonic()
+        self._task = None
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def is_revoked(self, token: str) -> bool:
+        if not self._revoked:
+            return False
+        return token_jti(token) in self._revoked
+
+    async def revoke(self, db, jti: str, expires_at: int):
+        try:
+            await db.execute(insert(RevokedToken).values(jti=jti, expires_at=expires_at))
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+        self._revoked[jti] = expires_at
+
+    async def refresh(self):
+        """Add the revocations made since the last refresh, by any worker."""
+        async with self.session_factory() as db:
+            rows = (await db.execute(on_primary(
+                select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+                .filter(RevokedToken.id > self._last_id - REVOCATION_REFRESH_OVERLAP)
+                .filter(RevokedToken.expires_at > int(time.time()))
+            ))).all()
+        for row in rows:
+            self._revoked[row.jti] = row.expires_at
+            self._last_id = max(self._last_id, row.id)
+
+    async def prune(self):
+        now = int(time.time())
+        self._revoked = {jti: expires_at for jti, expires_at in self._revoked.items() if expires_at > now}
+        async with self.session_factory() as db:
+            await db.execute(delete(RevokedToken).filter(RevokedToken.expires_at <= now))
+            await db.commit()
+
+    def clear(self):
+        self._revoked.clear()
+        self._last_id = 0
+
+    def stats(self):
+        return {"revoked": len(self._revoked), "last_id": self._last_id}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+                if time.monotonic() - self._last_prune >= self.prune_interval:
+                    self._last_prune = time.monotonic()
+                    await self.prune()
+            except Exception:
+                logger.exception("Could not refresh revoked tokens")
+
+    async def start(self):
+        if self._task is None:
+            await self.refresh()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+revoked_tokens = RevocationList()
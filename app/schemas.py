@@ -1,6 +1,6 @@
 import re
 from pydantic import BaseModel, EmailStr, field_validator, Field
-from typing import Optional, List
+from typing import Optional, List, FrozenSet
 
 
 class UserCreate(BaseModel):
@@ -39,9 +39,20 @@ class UserRead(BaseModel):
     class Config:
         from_attributes = True
 
+class UserBatchResult(BaseModel):
+    index: int
+    user: Optional[UserRead] = None
+    error: Optional[str] = None
+
 class UserCheckPermisions(BaseModel):
     id: int
 
+class Principal(BaseModel):
+    id: int
+    username: str
+    permissions: FrozenSet[int] = frozenset()
+    permissions_version: int = 0
+
 class Token(BaseModel):
     access_token: str
     token_type: str
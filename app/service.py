@@ -1,45 +1,171 @@
+import asyncio
+import base64
+import csv
+import io
+import json
 import os
+import time
+import uuid
+import orjson
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
-from . import schemas, repository
+from . import profiling, schemas, repository
+from .cache import principal_cache, permission_versions, count_cache, page_cache
+from .hashing import hashing_executor
+from .revocation import revoked_tokens
+from .models import ADMIN_PERMISSION_ID, USER_PERMISSION_ID
 
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+JWT_PERMISSION_CLAIMS = os.getenv("JWT_PERMISSION_CLAIMS", "false").lower() == "true"
+EXACT_COUNT_LIMIT = int(os.getenv("EXACT_COUNT_LIMIT", 1_000))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1_000))
+EXPORT_COLUMNS = ("id", "username", "name", "surname", "email")
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def create_user(db: Session, user: schemas.UserCreate):
-    return repository.create_user(db=db, user=user)
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    return await repository.create_user(db=db, user=user)
 
-def get_user(db: Session, username: str):
-    return repository.get_user(db, username)
+async def create_users(db: AsyncSession, users: list[schemas.UserCreate]):
+    """
+    Create a batch of users in one transaction and report per-row results.
+    Rows whose username or email is already registered (or repeated within
+    the batch) or that name unknown permissions are rejected; the others are
+    hashed in parallel and inserted together.
+    """
+    results = [schemas.UserBatchResult(index=index) for index in range(len(users))]
+    taken_usernames, taken_emails = await repository.find_registered(
+        db, [user.username for user in users], [user.email for user in users])
+    known_permissions = await repository.get_existing_permission_ids(
+        db, {permission_id for user in users for permission_id in user.permissions})
+    seen_usernames, seen_emails = set(), set()
+    pending = []
+    for index, user in enumerate(users):
+        unknown_permissions = set(user.permissions) - known_permissions
+        if user.email in taken_emails:
+            results[index].error = "Email already registered"
+        elif user.username in taken_usernames:
+            results[index].error = "Username already registered"
+        elif user.email in seen_emails:
+            results[index].error = "Email repeated in batch"
+        elif user.username in seen_usernames:
+            results[index].error = "Username repeated in batch"
+        elif unknown_permissions:
+            results[index].error = f"Unknown permissions: {sorted(unknown_permissions)}"
+        else:
+            pending.append(index)
+        seen_usernames.add(user.username)
+        seen_emails.add(user.email)
+    if not pending:
+        return results
+    hashed_passwords = await asyncio.gather(
+        *(hashing_executor.hash_password(users[index].password) for index in pending))
+    created = await repository.create_users(
+        db,
+        [
+            {
+                "username": users[index].username,
+                "name": users[index].name,
+                "surname": users[index].surname,
+                "email": users[index].email,
+                "password": hashed_password,
+            }
+            for index, hashed_password in zip(pending, hashed_passwords)
+        ],
+        [list(dict.fromkeys(users[index].permissions)) for index in pending],
+    )
+    for index, row in zip(pending, created):
+        results[index].user = schemas.UserRead.model_validate(row)
+    return results
 
-def get_user_by_email(db: Session, email: str):
-    return repository.get_user_by_email(db, email)
+async def get_user(db: AsyncSession, username: str):
+    return await repository.get_user(db, username)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = repository.get_user(db, username)
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await repository.get_user_by_email(db, email)
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await repository.get_user(db, username)
     if not user:
         return False
-    if not repository.verify_password(password, user.password):
+    if not await hashing_executor.verify_password(password, user.password):
         return False
     return user
 
+def permissions_to_mask(permission_ids):
+    mask = 0
+    for permission_id in permission_ids:
+        mask |= 1 << permission_id
+    return mask
+
+def mask_to_permissions(mask: int):
+    return frozenset(bit for bit in range(mask.bit_length()) if mask >> bit & 1)
+
+async def get_token_claims(db: AsyncSession, user):
+    """
+    Claims for a new access token. With JWT_PERMISSION_CLAIMS enabled the token
+    also carries the user id, the permission set as a bitmask and the user's
+    permission version, so requests can be authorized without a DB lookup.
+    """
+    claims = {"sub": user.username}
+    if JWT_PERMISSION_CLAIMS:
+        permission_ids = await repository.get_user_permission_ids(db, user.id)
+        permission_versions.observe(user.id, user.permissions_version)
+        claims.update({
+            "uid": user.id,
+            "perms": permissions_to_mask(permission_ids),
+            "pv": user.permissions_version,
+        })
+    return claims
+
+async def get_permissions_version(db: AsyncSession, user_id: int):
+    """The user's current permission version, read from the database at most every PERMISSION_VERSION_TTL."""
+    version = permission_versions.get(user_id)
+    if version is None:
+        version = await repository.get_permissions_version(db, user_id)
+        if version is not None:
+            permission_versions.observe(user_id, version)
+    return version
+
+async def get_principal_from_claims(db: AsyncSession, payload: dict):
+    """The principal embedded in the token, or None when it has no claims or they are stale."""
+    if not JWT_PERMISSION_CLAIMS or not {"uid", "perms", "pv"} <= payload.keys():
+        return None
+    version = await get_permissions_version(db, payload["uid"])
+    if version is None or payload["pv"] < version:
+        return None
+    return schemas.Principal(
+        id=payload["uid"],
+        username=payload["sub"],
+        permissions=mask_to_permissions(payload["perms"]),
+        permissions_version=payload["pv"],
+    )
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(db: Session, token: str = Depends(oauth2_scheme)):
+async def get_current_user(db: AsyncSession, token: str = Depends(oauth2_scheme)):
+    with profiling.timed("auth"):
+        if revoked_tokens.is_revoked(token):
+            return False
+        return await _resolve_principal(db, token)
+
+async def _resolve_principal(db: AsyncSession, token: str):
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -48,20 +174,104 @@ def get_current_user(db: Session, token: str = Depends(oauth2_scheme)):
         token_data = schemas.TokenData(username=username)
     except JWTError:
         return False
-    user = get_user(db, username=token_data.username)
-    if user is None:
+    ttl = payload["exp"] - time.time() if "exp" in payload else None
+    generation = principal_cache.generation()
+    principal = await get_principal_from_claims(db, payload)
+    if principal is not None:
+        # Re-check the claims as often as the permission version is re-read.
+        claims_ttl = permission_versions.ttl if ttl is None else min(ttl, permission_versions.ttl)
+        principal_cache.set(token, principal, ttl=claims_ttl, generation=generation)
+        return principal
+    principal = await repository.get_principal(db, username=token_data.username)
+    if principal is None:
+        return False
+    permission_versions.observe(principal.id, principal.permissions_version)
+    principal_cache.set(token, principal, ttl=ttl, generation=generation)
+    return principal
+
+async def revoke_token(db: AsyncSession, token: str):
+    """Revoke a valid `token`; False if it has no jti (issued before revocation existed)."""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if "jti" not in payload:
         return False
-    return schemas.UserRead.model_validate(user)
+    await revoked_tokens.revoke(db, payload["jti"], payload["exp"])
+    principal_cache.pop(token)
+    return True
+
+async def check_is_admin(db: AsyncSession, user: schemas.Principal):
+    return ADMIN_PERMISSION_ID in user.permissions
 
-def check_is_admin(db: Session, user: schemas.UserCheckPermisions):
-    return repository.check_is_admin(db, user)
+async def check_is_admin_or_user(db: AsyncSession, user: schemas.Principal):
+    return not user.permissions.isdisjoint({ADMIN_PERMISSION_ID, USER_PERMISSION_ID})
 
-def check_is_admin_or_user(db: Session, user: schemas.UserCheckPermisions):
-    return repository.check_is_admin_or_user(db, user)
+def filter_users(name: Optional[str] = None,
+        surname: Optional[str] = None,
+        email: Optional[str] = None,
+        after_id: Optional[int] = None):
+    return repository.filter_users(name, surname, email, after_id)
 
-def filter_users(db: Session,
+async def count_users(db: AsyncSession,
         name: Optional[str] = None,
         surname: Optional[str] = None,
         email: Optional[str] = None):
-    return repository.filter_users(db, name, surname, email)
+    """
+    Number of users matching the filters, as `(total, exact)`. Up to
+    EXACT_COUNT_LIMIT matches are counted exactly; beyond that the planner
+    estimate is used where available, so the count never scans the whole
+    result. Results are cached per filter until the next user is created, using
+    the page cache's users generation so the Redis backend shares it.
+    """
+    key = (await page_cache.generation(), *((value or "").lower() for value in (name, surname, email)))
+    cached = count_cache.get(key)
+    if cached is not None:
+        return cached
+    query = filter_users(name, surname, email)
+    total, exact = await repository.count_rows(db, query, limit=EXACT_COUNT_LIMIT + 1), True
+    if total > EXACT_COUNT_LIMIT:
+        estimate = await repository.estimate_rows(db, query)
+        if estimate is None:
+            total = await repository.count_rows(db, query)
+        else:
+            total, exact = max(estimate, total), False
+    count_cache.set(key, (total, exact))
+    return total, exact
+
+async def export_users(query, export_format: str):
+    """Encode the rows of `query` as NDJSON or CSV, one chunk per fetched batch."""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+    async for rows in repository.stream_user_rows(query, EXPORT_CHUNK_SIZE):
+        if export_format == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+        else:
+            yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows)
+
+async def list_users(db: AsyncSession, query, skip: int, limit: int):
+    return await repository.list_user_rows(db, query, skip, limit)
+
+def encode_users(rows) -> bytes:
+    """
+    JSON array of `rows` as returned by `list_users`. The rows were validated
+    on the way in, so they are not run through `schemas.UserRead` again.
+    """
+    with profiling.timed("serialize"):
+        return orjson.dumps([dict(zip(EXPORT_COLUMNS, row)) for row in rows])
+
+def encode_cursor(last_id: int):
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["id"]
+    except (ValueError, TypeError, KeyError) as error:
+        raise ValueError("Invalid cursor") from error
+    if not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
+    return last_id
 
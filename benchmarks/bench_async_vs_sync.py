@@ -0,0 +1,90 @@
+"""
+Requests/sec of the blocking Session path versus the AsyncSession path for
+an authenticated /list_users/ call, at the same client concurrency.
+
+The sync side is a minimal app that reproduces the pre-async handler: a sync
+`def` endpoint running in Starlette's threadpool on a blocking Session.
+
+    DATABASE_URL=postgresql://... SECRET_KEY=... ALGORITHM=HS256 \
+        python -m benchmarks.bench_async_vs_sync --users 10000 --concurrency 64
+"""
+import argparse
+from typing import Optional
+from fastapi import Depends, FastAPI, Query
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+from app import models, schemas, service
+from app.database import SessionLocal
+from app.exceptions import CustomExceptions
+from app.main import app as async_app
+from benchmarks.harness import admin_token, drive, format_result, seed_users, serve
+
+
+def build_sync_app():
+    sync_app = FastAPI()
+    oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+    def get_sync_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @sync_app.get("/list_users/", response_model=list[schemas.UserRead])
+    def list_users(
+        skip: int = Query(0, ge=0),
+        limit: int = Query(10, ge=1),
+        name: Optional[str] = None,
+        surname: Optional[str] = None,
+        email: Optional[str] = None,
+        db: Session = Depends(get_sync_db),
+        token: str = Depends(oauth2_scheme),
+    ):
+        try:
+            payload = jwt.decode(token, service.SECRET_KEY, algorithms=[service.ALGORITHM])
+        except JWTError:
+            raise CustomExceptions.get_credentials_exception()
+        user = db.query(models.User).filter(models.User.username == payload.get("sub")).first()
+        if user is None:
+            raise CustomExceptions.get_credentials_exception()
+        if not db.query(models.UserPermission).filter(
+                models.UserPermission.user_id == user.id,
+                models.UserPermission.permission_id.in_([1, 3])).first():
+            raise CustomExceptions.get_not_authorized_exception()
+        query = db.query(models.User)
+        if name:
+            query = query.filter(models.User.name.ilike(f"%{name}%"))
+        if surname:
+            query = query.filter(models.User.surname.ilike(f"%{surname}%"))
+        if email:
+            query = query.filter(models.User.email.ilike(f"%{email}%"))
+        return query.offset(skip).limit(limit).all()
+
+    return sync_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    headers = {"Authorization": f"Bearer {admin_token()}"}
+
+    async def list_users(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers,
+                                params={"skip": (worker_id * 97 + iteration) % 1000, "limit": 10})
+
+    for label, app in (("sync Session", build_sync_app()), ("async AsyncSession", async_app)):
+        with serve(app) as base_url:
+            drive(list_users, base_url, args.concurrency, 1.0)
+            result = drive(list_users, base_url, args.concurrency, args.duration)
+        print(format_result(label, result))
+
+
+if __name__ == "__main__":
+    main()
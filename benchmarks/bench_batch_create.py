@@ -0,0 +1,78 @@
+"""
+Users created per second through one /create_users batch call versus the
+same number of /create_user calls made at a fixed concurrency.
+
+    python -m benchmarks.bench_batch_create --count 1000 --concurrency 16
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import httpx
+from app.main import app
+from benchmarks.harness import admin_token, seed_users, serve
+
+
+def new_users(count: int):
+    run_id = uuid.uuid4().hex[:8]
+    return [
+        {
+            "username": f"b{run_id}{i}",
+            "email": f"b{run_id}{i}@example.com",
+            "name": "Batch",
+            "surname": "User",
+            "password": "G*qE/6r$",
+            "permissions": [2],
+        }
+        for i in range(count)
+    ]
+
+
+async def single_calls(base_url: str, headers: dict, users: list, concurrency: int):
+    queue = asyncio.Queue()
+    for user in users:
+        queue.put_nowait(user)
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=600) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                response = await client.post("/create_user", json=queue.get_nowait())
+                errors += response.status_code != 200
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return errors
+
+
+async def batch_call(base_url: str, headers: dict, users: list, batch_size: int):
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=600) as client:
+        for start in range(0, len(users), batch_size):
+            response = await client.post("/create_users", json=users[start:start + batch_size])
+            errors += sum(result["error"] is not None for result in response.json())
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=1_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    args = parser.parse_args()
+
+    seed_users(0)
+    headers = {"Authorization": f"Bearer {admin_token()}"}
+    with serve(app) as base_url:
+        for label, job in (
+            (f"{args.count} x /create_user", lambda: single_calls(base_url, headers, new_users(args.count), args.concurrency)),
+            (f"/create_users batches of {args.batch_size}", lambda: batch_call(base_url, headers, new_users(args.count), args.batch_size)),
+        ):
+            started = time.perf_counter()
+            errors = asyncio.run(job())
+            elapsed = time.perf_counter() - started
+            print(f"{label:<32} {args.count / elapsed:>8.1f} users/s  ({elapsed:.2f} s, errors {errors})")
+
+
+if __name__ == "__main__":
+    main()
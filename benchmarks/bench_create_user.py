@@ -0,0 +1,48 @@
+"""
+SQL statements per /create_user call and latency under concurrent creates.
+
+    python -m benchmarks.bench_create_user --concurrency 32 --duration 10
+"""
+import argparse
+import uuid
+from sqlalchemy import event
+from app.database import async_engine
+from app.main import app
+from benchmarks.harness import admin_token, drive, format_result, seed_users, serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    seed_users(0)
+    headers = {"Authorization": f"Bearer {admin_token()}"}
+    run_id = uuid.uuid4().hex[:8]
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def create_user(client, worker_id, iteration):
+        username = f"c{run_id}w{worker_id}i{iteration}"
+        return await client.post("/create_user", headers=headers, json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "name": "Create",
+            "surname": "User",
+            "password": "G*qE/6r$",
+            "permissions": [2],
+        })
+
+    with serve(app) as base_url:
+        event.listen(async_engine.sync_engine, "before_cursor_execute", record_statement)
+        result = drive(create_user, base_url, args.concurrency, args.duration)
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record_statement)
+    print(format_result("/create_user", result))
+    print(f"statements per call: {len(statements) / max(result['requests'], 1):.2f}")
+
+
+if __name__ == "__main__":
+    main()
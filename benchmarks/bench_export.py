@@ -0,0 +1,54 @@
+"""
+Peak Python memory and throughput of the streaming user export, compared with
+materializing the same rows through the paged /list_users/ query.
+
+    python -m benchmarks.bench_export --users 1000000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from pydantic import TypeAdapter
+from app import schemas, service
+from app.database import AsyncSessionLocal, async_engine
+from benchmarks.harness import seed_users
+
+
+async def export(export_format: str):
+    exported = 0
+    async for chunk in service.export_users(service.filter_users(), export_format):
+        exported += len(chunk)
+    return exported
+
+
+async def materialize():
+    async with AsyncSessionLocal() as db:
+        users = (await db.scalars(service.filter_users())).all()
+        return len(TypeAdapter(list[schemas.UserRead]).dump_json(users))
+
+
+async def run():
+    for label, job in (("export ndjson", lambda: export("ndjson")),
+                       ("export csv", lambda: export("csv")),
+                       ("materialized list", materialize)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = await job()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<20} {size / 1e6:>8.1f} MB in {elapsed:>6.2f} s  peak {peak / 1e6:>8.1f} MB")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
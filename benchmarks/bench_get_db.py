@@ -0,0 +1,53 @@
+"""
+Per-request cost of repository.get_db with and without the seeding check it
+used to run on every request (SELECT COUNT(*) FROM users), measured around a
+single principal lookup on a seeded users table.
+
+    python -m benchmarks.bench_get_db --users 1000000 --iterations 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from sqlalchemy import func, select
+from app import models, repository
+from app.database import async_engine
+from benchmarks.harness import BENCH_ADMIN, percentile, seed_users
+
+
+async def measure(iterations: int, with_seed_check: bool):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        async for db in repository.get_db():
+            if with_seed_check:
+                await db.scalar(select(func.count()).select_from(models.User))
+            await repository.get_principal(db, BENCH_ADMIN)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def run(iterations: int):
+    await measure(50, False)
+    results = {
+        "get_db + COUNT(*) seed check": await measure(iterations, True),
+        "get_db": await measure(iterations, False),
+    }
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    for label, samples in asyncio.run(run(args.iterations)).items():
+        print(f"{label:<32} mean {statistics.fmean(samples) * 1000:>7.3f} ms  "
+              f"p99 {percentile(samples, 99) * 1000:>7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Cost per row of one /list_users/ page: loading User entities and validating
+them against schemas.UserRead, as the endpoint used to, versus selecting the
+columns as plain rows and encoding them with orjson.
+
+    python -m benchmarks.bench_list_users_encoding --limit 1000 --repeat 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from pydantic import TypeAdapter
+from app import schemas, service
+from app.database import AsyncSessionLocal, async_engine
+from benchmarks.harness import seed_users
+
+
+async def entities_validated(db, limit: int):
+    users = (await db.scalars(service.filter_users().limit(limit))).all()
+    adapter = TypeAdapter(list[schemas.UserRead])
+    return adapter.dump_json(adapter.validate_python(users, from_attributes=True))
+
+
+async def rows_orjson(db, limit: int):
+    return service.encode_users(await service.list_users(db, service.filter_users(), 0, limit))
+
+
+async def run(limit: int, repeat: int):
+    for label, job in (("entities + validation", entities_validated), ("rows + orjson", rows_orjson)):
+        samples = []
+        for _ in range(repeat):
+            async with AsyncSessionLocal() as db:
+                started = time.perf_counter()
+                body = await job(db, limit)
+                samples.append(time.perf_counter() - started)
+        median = statistics.median(samples)
+        print(f"{label:<24} median {median * 1000:>8.2f} ms/page  {median / limit * 1e6:>6.2f} us/row  ({len(body)} bytes)")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    asyncio.run(run(args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
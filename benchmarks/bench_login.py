@@ -0,0 +1,35 @@
+"""
+/token throughput for the configured hashing executor. Run it once per
+setting to see login throughput follow HASHING_WORKERS:
+
+    HASHING_EXECUTOR=thread HASHING_WORKERS=1 python -m benchmarks.bench_login
+    HASHING_EXECUTOR=process python -m benchmarks.bench_login
+"""
+import argparse
+from app.hashing import hashing_executor
+from app.main import app
+from benchmarks.harness import BENCH_ADMIN, BENCH_PASSWORD, drive, format_result, seed_users, serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    seed_users(0)
+
+    async def login(client, worker_id, iteration):
+        return await client.post("/token", data={"username": BENCH_ADMIN, "password": BENCH_PASSWORD})
+
+    with serve(app) as base_url:
+        drive(login, base_url, args.concurrency, 1.0)
+        result = drive(login, base_url, args.concurrency, args.duration)
+        stats = hashing_executor.stats()
+    print(format_result(f"/token {stats['executor']} x{stats['workers']}", result))
+    print(f"hashing: avg {stats['hash_seconds_avg'] * 1000:.1f} ms, "
+          f"queue wait total {stats['queue_wait_seconds_total']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+p99 of authenticated /list_users/ calls while /token is hammered, with login
+admission control switched on and off.
+
+    python -m benchmarks.bench_login_admission --login-concurrency 256
+"""
+import argparse
+import asyncio
+from app import admission
+from app.main import app
+from benchmarks.harness import (BENCH_ADMIN, BENCH_PASSWORD, admin_token, drive, drive_async,
+                                format_result, seed_users, serve)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--read-concurrency", type=int, default=8)
+    parser.add_argument("--login-concurrency", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    headers = {"Authorization": f"Bearer {admin_token()}"}
+
+    async def list_users(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers)
+
+    async def login(client, worker_id, iteration):
+        return await client.post("/token", data={"username": BENCH_ADMIN, "password": BENCH_PASSWORD})
+
+    async def under_login_storm(base_url):
+        reads, logins = await asyncio.gather(
+            drive_async(list_users, base_url, args.read_concurrency, args.duration),
+            drive_async(login, base_url, args.login_concurrency, args.duration),
+        )
+        return reads, logins
+
+    with serve(app) as base_url:
+        print(format_result("/list_users/ alone", drive(list_users, base_url, args.read_concurrency, args.duration)))
+        for enabled in (False, True):
+            admission.login_admission.enabled = enabled
+            reads, logins = asyncio.run(under_login_storm(base_url))
+            label = "on" if enabled else "off"
+            print(format_result(f"/list_users/ admission {label}", reads))
+            print(format_result(f"/token admission {label}", logins))
+    print(admission.login_admission.stats())
+
+
+if __name__ == "__main__":
+    main()
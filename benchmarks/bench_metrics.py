@@ -0,0 +1,62 @@
+"""
+Overhead of the metrics middleware: the cost per request on a bare ASGI app
+called in-process, and /list_users/ throughput with metrics on and off.
+
+    python -m benchmarks.bench_metrics --requests 100000 --concurrency 32 --duration 10
+"""
+import argparse
+import asyncio
+import time
+from app import metrics
+from app.main import app
+from benchmarks.harness import admin_token, drive, format_result, seed_users, serve
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def call_in_process(asgi_app, requests: int):
+    scope = {"type": "http", "method": "GET", "path": "/"}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await asgi_app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    bare = asyncio.run(call_in_process(bare_app, args.requests))
+    wrapped = asyncio.run(call_in_process(metrics.MetricsMiddleware(bare_app), args.requests))
+    print(f"middleware overhead: {(wrapped - bare) * 1e6:.2f} us/request "
+          f"(bare {bare * 1e6:.2f} us, instrumented {wrapped * 1e6:.2f} us)")
+
+    seed_users(args.users)
+    headers = {"Authorization": f"Bearer {admin_token()}"}
+
+    async def list_users(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers, params={"limit": 10})
+
+    with serve(app) as base_url:
+        for enabled in (False, True):
+            metrics.registry.enabled = enabled
+            result = drive(list_users, base_url, args.concurrency, args.duration)
+            print(format_result(f"/list_users/ metrics {'on' if enabled else 'off'}", result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Cost of fetching page 1 and a deep page of /list_users/ with offset (skip)
+and keyset (cursor) pagination, measured on the repository query.
+
+    python -m benchmarks.bench_pagination --users 1000000 --page 10000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from sqlalchemy import select
+from app import models, repository
+from app.database import AsyncSessionLocal, async_engine
+from benchmarks.harness import seed_users
+
+
+async def time_query(db, query, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        (await db.scalars(query)).all()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+async def run(page: int, limit: int, repeat: int):
+    skip = (page - 1) * limit
+    async with AsyncSessionLocal() as db:
+        # Page 1 has no cursor; deeper pages start after the last id of the previous page.
+        after_id = None
+        if skip > 0:
+            after_id = await db.scalar(select(models.User.id).order_by(models.User.id).offset(skip - 1).limit(1))
+        results = {
+            "offset page 1": await time_query(db, repository.filter_users().limit(limit), repeat),
+            f"offset page {page}": await time_query(db, repository.filter_users().offset(skip).limit(limit), repeat),
+            "cursor page 1": await time_query(db, repository.filter_users(after_id=0).limit(limit), repeat),
+            f"cursor page {page}": await time_query(db, repository.filter_users(after_id=after_id).limit(limit), repeat),
+        }
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--page", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    for label, median_ms in asyncio.run(run(args.page, args.limit, args.repeat)).items():
+        print(f"{label:<24} median {median_ms:>8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Query plans and latency of the /list_users/ name, surname and email filters on
+a seeded users table. On PostgreSQL the plans should show bitmap scans on the
+ix_users_*_trgm indexes; SQLite has no substring index and always scans.
+
+    python -m benchmarks.bench_search --users 1000000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from sqlalchemy import text
+from app import repository
+from app.database import AsyncSessionLocal, async_engine
+from benchmarks.harness import seed_users
+
+SEARCHES = [
+    {"name": "Name42"},
+    {"surname": "name499"},
+    {"email": "user12345@"},
+    {"name": "Name7", "surname": "Surname7"},
+]
+
+
+def explain_prefix(dialect_name: str):
+    if dialect_name == "postgresql":
+        return "EXPLAIN (ANALYZE, BUFFERS) "
+    return "EXPLAIN QUERY PLAN "
+
+
+async def run(limit: int, repeat: int):
+    async with AsyncSessionLocal() as db:
+        dialect = db.bind.dialect
+        for filters in SEARCHES:
+            query = repository.filter_users(**filters).limit(limit)
+            compiled = query.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+            plan = (await db.execute(text(explain_prefix(dialect.name) + str(compiled)))).all()
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                (await db.scalars(query)).all()
+                samples.append(time.perf_counter() - started)
+            print(f"{filters}: median {statistics.median(samples) * 1000:.3f} ms")
+            for row in plan:
+                print("    " + " | ".join(str(column) for column in row))
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    asyncio.run(run(args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
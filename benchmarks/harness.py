@@ -0,0 +1,138 @@
+"""
+Shared helpers for the benchmark scripts: seeding a database, serving an ASGI
+app with uvicorn in a background thread and driving it with a fixed number of
+concurrent clients.
+
+The scripts import `app.*`, so DATABASE_URL, SECRET_KEY and ALGORITHM must be
+set exactly as for the application itself.
+"""
+import asyncio
+import contextlib
+import socket
+import statistics
+import threading
+import time
+from typing import Callable, Optional
+import httpx
+import uvicorn
+from sqlalchemy import select
+from app import loader, models, service
+from app.database import Base, SessionLocal, engine
+from app.repository import get_password_hash
+
+BENCH_ADMIN = "bench_admin"
+BENCH_PASSWORD = "G*qE/6r$"
+
+
+def seed_users(count: int, batch_size: int = 10_000):
+    """
+    Create the schema and load `count` synthetic users plus one admin
+    (BENCH_ADMIN / BENCH_PASSWORD) through `app.loader`. Every synthetic user
+    shares one password hash, so seeding cost is dominated by the inserts.
+    Re-running against an already seeded database is a no-op.
+    """
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if db.scalar(select(models.User.id).where(models.User.username == BENCH_ADMIN)):
+            return
+    shared_hash = get_password_hash(BENCH_PASSWORD)
+    if count:
+        stats = loader.load_users(loader.synthetic_users(count), engine, batch_size, shared_hash=shared_hash)
+        print(f"seeded {stats['users']} users at {stats['rows_per_second']:.0f} users/s")
+    with SessionLocal() as db:
+        permissions = {}
+        for name in ("admin", "guest", "user"):
+            permission = db.scalar(select(models.Permission).where(models.Permission.name == name))
+            if permission is None:
+                permission = models.Permission(name=name)
+                db.add(permission)
+                db.flush()
+            permissions[name] = permission.id
+        admin = models.User(username=BENCH_ADMIN, name="Bench", surname="Admin",
+                            email="bench_admin@example.com", password=shared_hash)
+        db.add(admin)
+        db.flush()
+        db.add(models.UserPermission(user_id=admin.id, permission_id=permissions["admin"]))
+        db.commit()
+
+
+def admin_token():
+    return service.create_access_token(data={"sub": BENCH_ADMIN})
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(app, port: Optional[int] = None):
+    """Run `app` under uvicorn in a daemon thread and yield its base URL."""
+    port = port or _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                           log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def percentile(samples: list, pct: float):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def drive_async(make_request: Callable, base_url: str, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(worker_id: int):
+            nonlocal errors
+            iteration = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await make_request(client, worker_id, iteration)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+                iteration += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def drive(make_request: Callable, base_url: str, concurrency: int, duration: float):
+    """
+    Call `await make_request(client, worker_id, iteration)` from `concurrency`
+    workers for `duration` seconds and return throughput/latency figures.
+    """
+    return asyncio.run(drive_async(make_request, base_url, concurrency, duration))
+
+
+def format_result(label: str, result: dict):
+    return (f"{label:<28} {result['rps']:>9.1f} req/s  "
+            f"p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  "
+            f"p99 {result['p99_ms']:>7.1f} ms  errors {result['errors']}")
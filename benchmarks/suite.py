@@ -0,0 +1,156 @@
+"""
+Run every endpoint scenario at fixed concurrency levels, write the throughput
+and latency figures to a JSON results file and compare them with a baseline.
+
+    python -m benchmarks.suite --users 100000 --concurrency 1,16,64 --duration 10
+    python -m benchmarks.suite --save-baseline          # record benchmarks/baseline.json
+    python -m benchmarks.suite --threshold 0.15         # fail on >15% regressions
+
+The exit status is 1 when any scenario is slower than the baseline by more
+than the threshold: throughput lower, or p95 latency higher.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sys
+import uuid
+from sqlalchemy.engine import make_url
+from app import admission, service
+from app.database import SQLALCHEMY_DATABASE_URL
+from app.main import app
+from benchmarks.harness import BENCH_ADMIN, BENCH_PASSWORD, admin_token, drive, format_result, seed_users, serve
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_RESULTS = os.path.join(os.path.dirname(__file__), "results.json")
+
+
+def scenarios(users: int):
+    headers = {"Authorization": f"Bearer {admin_token()}"}
+    run_id = uuid.uuid4().hex[:8]
+    sequence = itertools.count()
+    deep_offset = max(0, users - 100)
+    deep_cursor = service.encode_cursor(deep_offset)
+
+    async def token(client, worker_id, iteration):
+        return await client.post("/token", data={"username": BENCH_ADMIN, "password": BENCH_PASSWORD})
+
+    async def create_user(client, worker_id, iteration):
+        username = f"s{run_id}n{next(sequence)}"
+        return await client.post("/create_user", headers=headers, json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "name": "Suite",
+            "surname": "User",
+            "password": BENCH_PASSWORD,
+            "permissions": [2],
+        })
+
+    async def list_users(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers, params={"limit": 10})
+
+    async def list_users_filtered(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers,
+                                params={"name": f"Name{(worker_id * 7919 + iteration) % 1000}", "limit": 10})
+
+    async def list_users_deep_offset(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers, params={"skip": deep_offset, "limit": 10})
+
+    async def list_users_deep_cursor(client, worker_id, iteration):
+        return await client.get("/list_users/", headers=headers, params={"cursor": deep_cursor, "limit": 10})
+
+    async def counters(client, worker_id, iteration):
+        return await client.get("/counters/", headers=headers)
+
+    return {
+        "token": token,
+        "create_user": create_user,
+        "list_users": list_users,
+        "list_users_filtered": list_users_filtered,
+        "list_users_deep_offset": list_users_deep_offset,
+        "list_users_deep_cursor": list_users_deep_cursor,
+        "counters": counters,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Return one message per scenario that regressed beyond `threshold`."""
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result["rps"] < expected["rps"] * (1 - threshold):
+            regressions.append(f"{key}: {result['rps']:.1f} req/s, baseline {expected['rps']:.1f} req/s")
+        if result["p95_ms"] > expected["p95_ms"] * (1 + threshold):
+            regressions.append(f"{key}: p95 {result['p95_ms']:.1f} ms, baseline {expected['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--concurrency", default="1,16,64",
+                        help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--scenarios", default=None,
+                        help="comma-separated subset of scenarios to run")
+    parser.add_argument("--results", default=DEFAULT_RESULTS)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to --baseline instead of comparing")
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    # Every client logs in from 127.0.0.1 as the same user; measure /token
+    # itself rather than the login rate limits.
+    admission.login_admission.enabled = False
+    levels = [int(level) for level in args.concurrency.split(",")]
+    selected = scenarios(args.users)
+    if args.scenarios:
+        selected = {name: selected[name] for name in args.scenarios.split(",")}
+
+    results = {}
+    with serve(app) as base_url:
+        for name, make_request in selected.items():
+            for concurrency in levels:
+                drive(make_request, base_url, concurrency, args.warmup)
+                result = drive(make_request, base_url, concurrency, args.duration)
+                key = f"{name}@{concurrency}"
+                results[key] = result
+                print(format_result(key, result))
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "database": make_url(SQLALCHEMY_DATABASE_URL).get_backend_name(),
+        "python": platform.python_version(),
+        "users": args.users,
+        "duration": args.duration,
+        "results": results,
+    }
+    path = args.baseline if args.save_baseline else args.results
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"wrote {path}")
+    if args.save_baseline:
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
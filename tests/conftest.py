@@ -0,0 +1,133 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from starlette.routing import Match
+from app.main import app
+from app.database import async_engine
+from app.counters import api_counters
+from app.revocation import revoked_tokens
+from app.test_db import init_db, drop_db, TestingSessionLocal
+from app.repository import get_password_hash
+from app import admission, models
+from app.cache import page_cache, principal_cache, permission_versions
+
+
+@pytest.fixture(scope="function")
+def test_client(monkeypatch):
+    init_db()
+    # Every test logs in from the same client; start each one with fresh rate limits.
+    monkeypatch.setattr(admission, "login_admission", admission.AdmissionController())
+    principal_cache.clear()
+    page_cache.clear()
+    revoked_tokens.clear()
+    permission_versions.clear()
+    db = TestingSessionLocal()
+    permission_admin = models.Permission(name="admin")
+    permission_guest = models.Permission(name="guest")
+    db.add(permission_admin)  
+    db.add(permission_guest)
+    db.commit()
+    db.refresh(permission_admin)
+    db.refresh(permission_guest)
+    admin_user = models.User(
+        email="admin@example.com",
+        username="admin",
+        name="John",
+        surname="Doe",
+        password=get_password_hash("G*qE/6r$"),  
+    )
+    db.add(admin_user)
+    admin_user_2 = models.User(
+        email="jack@example.com",
+        username="JackDoe",
+        name="Jack",
+        surname="Doe",
+        password=get_password_hash("G*qE/6r$"),  
+    )
+    db.add(admin_user_2)
+    guest_user_1 = models.User(
+        email="harry@example.com",
+        username="HarryDoe",
+        name="Harry",
+        surname="Doe",
+        password=get_password_hash("G*qE/6r$"),  
+    )
+    db.add(guest_user_1)
+    db.commit()
+    db.refresh(admin_user)
+    db.refresh(admin_user_2)
+    db.refresh(guest_user_1)
+    db.add(models.UserPermission(user_id=admin_user.id, permission_id=permission_admin.id))
+    db.add(models.UserPermission(user_id=admin_user_2.id, permission_id=permission_admin.id))
+    db.add(models.UserPermission(user_id=guest_user_1.id, permission_id=permission_guest.id))
+    db.commit()
+    db.close()
+    # Keep the periodic counter flush out of the statements counted per request.
+    flush_interval, api_counters.flush_interval = api_counters.flush_interval, 3600
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        api_counters.flush_interval = flush_interval
+    drop_db()
+
+
+# Maximum SQL statements per request, by method and route. A change that needs
+# more round trips must raise its budget here, on purpose.
+QUERY_BUDGETS = {
+    ("POST", "/create_user"): 3,
+    ("POST", "/create_users"): 6,
+    ("POST", "/token"): 2,
+    ("GET", "/list_users/"): 3,
+    ("GET", "/export_users/"): 2,
+    ("GET", "/counters/"): 2,
+    ("GET", "/metrics"): 0,
+    ("POST", "/logout"): 2,
+}
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "query_budget(statements): override the statement budget of every request in the test")
+
+
+def route_template(method: str, path: str):
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    for route in app.routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return None
+
+
+@pytest.fixture(autouse=True)
+def query_budget(request, monkeypatch):
+    """
+    Count the statements each TestClient request runs on the async engine and
+    fail the test, listing them, when a request goes over its route's budget.
+    """
+    marker = request.node.get_closest_marker("query_budget")
+    send = TestClient.request
+
+    def budgeted_request(self, method, url, *args, **kwargs):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, cursor.rowcount))
+
+        event.listen(async_engine.sync_engine, "after_cursor_execute", record)
+        try:
+            response = send(self, method, url, *args, **kwargs)
+        finally:
+            event.remove(async_engine.sync_engine, "after_cursor_execute", record)
+        method = method.upper()
+        route = route_template(method, response.request.url.path)
+        budget = marker.args[0] if marker else QUERY_BUDGETS.get((method, route))
+        if budget is not None and len(statements) > budget:
+            listing = "\n".join(
+                f"  {index}. {' '.join(statement.split())}" + (f"  [{rowcount} rows]" if rowcount >= 0 else "")
+                for index, (statement, rowcount) in enumerate(statements, 1)
+            )
+            pytest.fail(f"{method} {route} ran {len(statements)} SQL statements, budget is {budget}:\n{listing}")
+        return response
+
+    monkeypatch.setattr(TestClient, "request", budgeted_request)
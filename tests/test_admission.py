@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app import admission
+from app.admission import AdmissionController, TokenBucket
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=1.0, capacity=2, now=0.0)
+    assert bucket.take(0.0) == 0
+    assert bucket.take(0.0) == 0
+    assert bucket.take(0.0) == pytest.approx(1.0)
+    assert bucket.take(1.0) == 0
+
+def test_full_queue_is_shed_with_retry_after():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5,
+                                     ip_rate=100, ip_burst=100, username_rate=100, username_burst=100)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("10.0.0.1", "admin"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 1
+        with pytest.raises(HTTPException) as exc_info:
+            async with controller.admit("10.0.0.1", "admin"):
+                pass
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return exc_info.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) >= 1
+    assert controller.stats() == {"enabled": True, "in_flight": 0, "queued": 0, "rate_limited": 0, "shed": 1}
+
+def test_login_is_rate_limited_per_username(test_client, monkeypatch):
+    monkeypatch.setattr(admission, "login_admission",
+                        AdmissionController(username_rate=0.01, username_burst=1))
+    response = test_client.post("/token", data={"username": "admin", "password": "G*qE/6r$"})
+    assert response.status_code == 200
+    response = test_client.post("/token", data={"username": "ADMIN", "password": "wrong"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+def test_rejected_login_does_not_use_up_the_ip_budget():
+    controller = AdmissionController(ip_rate=0.01, ip_burst=2, username_rate=0.01, username_burst=1)
+
+    async def attempt(username):
+        async with controller.admit("10.0.0.1", username):
+            pass
+
+    asyncio.run(attempt("admin"))
+    for _ in range(3):
+        with pytest.raises(HTTPException):
+            asyncio.run(attempt("admin"))
+    asyncio.run(attempt("other"))
+    assert controller.stats()["rate_limited"] == 3
@@ -0,0 +1,18 @@
+from sqlalchemy import func, select
+from app import models
+from app.bootstrap import bootstrap
+from app.test_db import drop_db, engine, TestingSessionLocal
+
+
+def test_bootstrap_seeds_once():
+    drop_db()
+    try:
+        assert bootstrap(engine) is True
+        assert bootstrap(engine) is False
+        with TestingSessionLocal() as db:
+            assert db.scalar(select(func.count()).select_from(models.User)) == 2
+            assert set(db.scalars(select(models.Permission.name))) == {"admin", "guest", "user"}
+            john = db.scalar(select(models.User).where(models.User.username == "John"))
+            assert [permission.permission.name for permission in john.permissions] == ["admin"]
+    finally:
+        drop_db()
@@ -0,0 +1,111 @@
+import asyncio
+import sys
+from app import schemas
+import pytest
+from app.cache import ByteSizedLRUCache, LRUCache, MemoryPageBackend, PageCache, PrincipalCache, make_page_cache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+def test_lru_cache_entries_expire():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=-1)
+    cache.set("b", 2, ttl=0.0001)
+    assert cache.get("a") is None
+    while cache.get("b") is not None:
+        pass
+    assert len(cache) == 0
+
+def test_principal_cache_invalidates_user():
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    cache.set("token-1", schemas.Principal(id=1, username="admin", permissions={1}))
+    cache.set("token-2", schemas.Principal(id=2, username="other"))
+    cache.invalidate_user("admin")
+    assert cache.get("token-1") is None
+    assert cache.get("token-2").id == 2
+
+def test_principal_cache_forgets_generations_without_cached_tokens():
+    cache = PrincipalCache(maxsize=1, ttl=60)
+    cache.invalidate_user("new-user")
+    assert cache._generations == {}
+    cache.set("token-1", schemas.Principal(id=1, username="admin"))
+    cache.invalidate_user("admin")
+    assert cache._generations == {"admin": 1}
+    cache.set("token-2", schemas.Principal(id=2, username="other"))
+    assert cache._generations == {}
+    cache.set("token-2", schemas.Principal(id=2, username="other"))
+    assert len(cache) == 1
+    cache.pop("token-2")
+    assert not cache._cached
+
+def test_principal_cache_skips_principals_read_before_an_invalidation():
+    cache = PrincipalCache(maxsize=10, ttl=60)
+    generation = cache.generation()
+    cache.invalidate_user("admin")
+    cache.set("token-1", schemas.Principal(id=1, username="admin", permissions={1}), generation=generation)
+    assert cache.get("token-1") is None
+    cache.set("token-1", schemas.Principal(id=1, username="admin"), generation=cache.generation())
+    assert cache.get("token-1").id == 1
+
+def test_byte_sized_cache_evicts_by_total_size():
+    cache = ByteSizedLRUCache(maxsize=10, ttl=60, max_bytes=20)
+    cache.set("a", b"123456789")
+    cache.set("b", b"123456789")
+    assert cache.bytes == 20
+    cache.set("c", b"1234")
+    assert cache.get("a") is None
+    assert cache.bytes == 15
+    cache.set("c", b"1")
+    assert cache.bytes == 12
+    cache.set("d", b"x" * 30)
+    assert cache.get("d") is None
+    cache.set("é", b"1")
+    assert cache.bytes == 15
+    cache.clear()
+    assert cache.bytes == 0
+
+def test_page_cache_misses_after_invalidation():
+    cache = PageCache(MemoryPageBackend(maxsize=10, ttl=60, max_bytes=1024))
+
+    async def run():
+        key = cache.key(await cache.generation(), "Jo", None, None, 0, 10, None)
+        assert cache.key(await cache.generation(), "jO", "", None, 0, 10, None) == key
+        await cache.set(key, b'[{"id": 1}]', "cursor")
+        assert await cache.get(key) == (b'[{"id": 1}]', "cursor")
+        await cache.invalidate()
+        new_key = cache.key(await cache.generation(), "Jo", None, None, 0, 10, None)
+        assert await cache.get(new_key) is None
+
+    asyncio.run(run())
+    assert cache.stats()["hit_ratio"] == 0.5
+
+def test_page_cache_ttl_zero_disables_pages_but_keeps_generation():
+    cache = make_page_cache("memory", ttl=0)
+
+    async def run():
+        await cache.set("key", b"[]", None)
+        assert await cache.get("key") is None
+        await cache.invalidate()
+        assert await cache.generation() == 1
+
+    asyncio.run(run())
+    assert cache.stats()["enabled"] is False
+    assert cache.stats()["misses"] == 0
+    with pytest.raises(ValueError):
+        make_page_cache("memory", ttl=-1)
+
+def test_redis_page_cache_without_redis_package_is_a_configuration_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", None)
+    with pytest.raises(RuntimeError, match="pip install redis"):
+        make_page_cache("redis", ttl=10)
@@ -0,0 +1,61 @@
+import asyncio
+from sqlalchemy import exc, literal_column, select, table, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app import database
+
+
+def test_engine_options_tune_the_pool():
+    options = database.engine_options("postgresql://user:password@db/app")
+    assert options["poolclass"] is database.TimedQueuePool
+    assert options["pool_size"] == database.DB_POOL_SIZE
+    assert options["max_overflow"] == database.DB_MAX_OVERFLOW
+    assert options["pool_timeout"] == database.DB_POOL_TIMEOUT
+    assert options["pool_recycle"] == database.DB_POOL_RECYCLE
+    assert options["pool_pre_ping"] == database.DB_POOL_PRE_PING
+
+def test_engine_options_set_the_statement_timeout(monkeypatch):
+    monkeypatch.setattr(database, "DB_STATEMENT_TIMEOUT_MS", 5000)
+    sync_options = database.engine_options("postgresql://user:password@db/app")
+    async_options = database.engine_options("postgresql+asyncpg://user:password@db/app", is_async=True)
+    assert sync_options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    assert async_options["connect_args"] == {"server_settings": {"statement_timeout": "5000"}}
+    assert async_options["poolclass"] is database.TimedAsyncAdaptedQueuePool
+
+def test_in_memory_sqlite_keeps_its_default_pool():
+    assert "poolclass" not in database.engine_options("sqlite://")
+
+
+async def _route(tmp_path, replica_url):
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/primary.db")
+    replica = create_async_engine(replica_url)
+    for engine, name in ((primary, "primary"), (replica, "replica")):
+        try:
+            async with engine.begin() as connection:
+                await connection.execute(text("CREATE TABLE source (name TEXT)"))
+                await connection.execute(text(f"INSERT INTO source VALUES ('{name}')"))
+        except exc.OperationalError:
+            pass
+
+    replicas = database.ReplicaSet([replica], retry_interval=60)
+    session_factory = async_sessionmaker(bind=primary, sync_session_class=database.RoutingSession,
+                                         replicas=replicas)
+    read = select(literal_column("name")).select_from(table("source"))
+    async with session_factory() as db:
+        assert await db.scalar(database.on_primary(read)) == "primary"
+        first_read = await db.scalar(read)
+        await db.execute(text("INSERT INTO source VALUES ('written')"))
+        read_after_write = await db.scalar(read)
+    async with session_factory() as db:
+        next_session_read = await db.scalar(read)
+    healthy = replicas.is_healthy(replica)
+    await primary.dispose()
+    await replica.dispose()
+    return first_read, read_after_write, next_session_read, healthy
+
+def test_routing_session_reads_from_replicas(tmp_path):
+    results = asyncio.run(_route(tmp_path, f"sqlite+aiosqlite:///{tmp_path}/replica.db"))
+    assert results == ("replica", "primary", "replica", True)
+
+def test_routing_session_fails_over_to_the_primary(tmp_path):
+    results = asyncio.run(_route(tmp_path, f"sqlite+aiosqlite:///{tmp_path}/missing/replica.db"))
+    assert results == ("primary", "primary", "primary", False)
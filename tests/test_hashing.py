@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+from app.hashing import HashingExecutor
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_hash_and_verify_password(kind):
+    executor = HashingExecutor(kind=kind, max_workers=2)
+
+    async def run():
+        hashed = await executor.hash_password("G*qE/6r$")
+        return (
+            await executor.verify_password("G*qE/6r$", hashed),
+            await executor.verify_password("wrong", hashed),
+        )
+
+    try:
+        assert asyncio.run(run()) == (True, False)
+    finally:
+        executor.shutdown()
+    stats = executor.stats()
+    assert stats["completed"] == 3
+    assert stats["in_flight"] == 0
+    assert stats["hash_seconds_total"] > 0
+
+def test_unknown_executor_kind():
+    with pytest.raises(ValueError):
+        HashingExecutor(kind="gpu")
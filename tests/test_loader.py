@@ -0,0 +1,46 @@
+import json
+from sqlalchemy import func, inspect, select
+from app import models
+from app.hashing import get_password_hash, verify_password
+from app.loader import load_users, read_csv, read_ndjson, synthetic_users
+from app.test_db import drop_db, engine, TestingSessionLocal
+
+
+def test_load_synthetic_users_with_a_shared_hash():
+    drop_db()
+    try:
+        shared_hash = get_password_hash("G*qE/6r$")
+        stats = load_users(synthetic_users(25, permissions=[2, 2]), engine, batch_size=10, shared_hash=shared_hash)
+        assert stats["users"] == 25
+        assert stats["permissions"] == 25
+        with TestingSessionLocal() as db:
+            assert db.scalar(select(func.count()).select_from(models.User)) == 25
+            assert set(db.scalars(select(models.UserPermission.permission_id))) == {2}
+            assert db.scalar(select(models.User.password).where(models.User.username == "user24")) == shared_hash
+        indexes = {index["name"] for index in inspect(engine).get_indexes("users")}
+        assert {"ix_users_name", "ix_users_surname"} <= indexes
+    finally:
+        drop_db()
+
+def test_load_csv_and_ndjson_users(tmp_path):
+    csv_path = tmp_path / "users.csv"
+    csv_path.write_text(
+        "username,name,surname,email,password,permissions\n"
+        "ann,Ann,Lee,ann@example.com,G*qE/6r$,1;2\n"
+    )
+    ndjson_path = tmp_path / "users.ndjson"
+    ndjson_path.write_text(json.dumps({
+        "username": "bob", "name": "Bob", "surname": "Ray", "email": "bob@example.com",
+        "password_hash": get_password_hash("G*qE/6r$"), "permissions": [],
+    }) + "\n")
+    drop_db()
+    try:
+        assert load_users(read_csv(str(csv_path)), engine)["permissions"] == 2
+        assert load_users(read_ndjson(str(ndjson_path)), engine)["users"] == 1
+        with TestingSessionLocal() as db:
+            ann = db.scalar(select(models.User).where(models.User.username == "ann"))
+            assert verify_password("G*qE/6r$", ann.password)
+            assert sorted(permission.permission_id for permission in ann.permissions) == [1, 2]
+            assert db.scalar(select(models.User.id).where(models.User.username == "bob")) is not None
+    finally:
+        drop_db()
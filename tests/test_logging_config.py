@@ -0,0 +1,30 @@
+import json
+import logging
+from app.logging_config import LogPipeline
+
+
+def test_pipeline_writes_json_lines(tmp_path):
+    path = tmp_path / "app.log"
+    pipeline = LogPipeline(filename=str(path), level="INFO", log_format="json")
+    logger = logging.getLogger("test_pipeline_writes_json_lines")
+    logger.propagate = False
+    pipeline.start(logger)
+    logger.info("GET %s", "/list_users")
+    logger.debug("not written")
+    pipeline.stop()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry["message"] == "GET /list_users"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "test_pipeline_writes_json_lines"
+
+def test_full_queue_drops_records(tmp_path):
+    pipeline = LogPipeline(filename=str(tmp_path / "app.log"), queue_size=2, policy="drop")
+    logger = logging.getLogger("test_full_queue_drops_records")
+    logger.propagate = False
+    logger.addHandler(pipeline.queue_handler)
+    for i in range(5):
+        logger.warning("record %d", i)
+    logger.removeHandler(pipeline.queue_handler)
+    assert pipeline.stats() == {"queued": 2, "dropped": 3}
@@ -1,57 +1,23 @@
+import asyncio
+import contextlib
+import json
+import os
+import pstats
 import pytest
-from fastapi.testclient import TestClient
-from app.main import app 
-from app.test_db import init_db, drop_db, TestingSessionLocal
-from app.repository import get_password_hash
-from app import models
-
-
-@pytest.fixture(scope="function")
-def test_client():
-    init_db()
-    db = TestingSessionLocal()
-    permission_admin = models.Permission(name="admin")
-    permission_guest = models.Permission(name="guest")
-    db.add(permission_admin)  
-    db.add(permission_guest)
-    db.commit()
-    db.refresh(permission_admin)
-    db.refresh(permission_guest)
-    admin_user = models.User(
-        email="admin@example.com",
-        username="admin",
-        name="John",
-        surname="Doe",
-        password=get_password_hash("G*qE/6r$"),  
-    )
-    db.add(admin_user)
-    admin_user_2 = models.User(
-        email="jack@example.com",
-        username="JackDoe",
-        name="Jack",
-        surname="Doe",
-        password=get_password_hash("G*qE/6r$"),  
-    )
-    db.add(admin_user_2)
-    guest_user_1 = models.User(
-        email="harry@example.com",
-        username="HarryDoe",
-        name="Harry",
-        surname="Doe",
-        password=get_password_hash("G*qE/6r$"),  
-    )
-    db.add(guest_user_1)
-    db.commit()
-    db.refresh(admin_user)
-    db.refresh(admin_user_2)
-    db.refresh(guest_user_1)
-    db.add(models.UserPermission(user_id=admin_user.id, permission_id=permission_admin.id))
-    db.add(models.UserPermission(user_id=admin_user_2.id, permission_id=permission_admin.id))
-    db.add(models.UserPermission(user_id=guest_user_1.id, permission_id=permission_guest.id))
-    db.commit()
-    db.close()
-    yield TestClient(app)
-    drop_db()
+import time
+from fastapi.routing import APIRoute
+from jose import jwt
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import cache, models, profiling, repository, service
+from app.cache import page_cache, principal_cache
+from app.counters import ApiCounters, api_counters
+from app.database import AsyncSessionLocal, async_engine
+from app.main import app
+from app.revocation import revoked_tokens
+from app.test_db import TestingSessionLocal
+from tests.conftest import QUERY_BUDGETS
+
 
 def authenticate_admin(test_client):
     login_response = test_client.post(
@@ -141,4 +107,363 @@ def test_list_users_filter_by_name(test_client):
     assert response.status_code == 200
     result = response.json()
     assert len(result) == 1
-    assert result[0]["name"] == "Harry"
\ No newline at end of file
+    assert result[0]["name"] == "Harry"
+
+def test_principal_is_cached_between_requests(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    before = test_client.get("/counters/", headers=headers).json()["principal_cache"]
+    assert test_client.get("/list_users/", headers=headers).status_code == 200
+    after = test_client.get("/counters/", headers=headers).json()["principal_cache"]
+    assert after["misses"] == before["misses"]
+    assert after["hits"] == before["hits"] + 2
+
+def test_permission_claims_are_embedded_and_versioned(test_client, monkeypatch):
+    monkeypatch.setattr(service, "JWT_PERMISSION_CLAIMS", True)
+    access_token = authenticate_admin(test_client)
+    claims = jwt.get_unverified_claims(access_token)
+    assert claims["perms"] == service.permissions_to_mask({1})
+    assert claims["pv"] == 0
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert test_client.get("/counters/", headers=headers).status_code == 200
+
+    async def revoke_admin():
+        async with AsyncSessionLocal() as db:
+            user = await repository.get_user(db, "admin")
+            return await repository.set_user_permissions(db, user, [2])
+
+    assert test_client.portal.call(revoke_admin) == 1
+    assert test_client.get("/counters/", headers=headers).status_code == 403
+
+def test_permission_change_by_another_worker_refuses_old_token(test_client, monkeypatch):
+    monkeypatch.setattr(service, "JWT_PERMISSION_CLAIMS", True)
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert test_client.get("/counters/", headers=headers).status_code == 200
+
+    # Another worker revokes the admin permission; this process is not told.
+    with TestingSessionLocal() as db:
+        admin = db.query(models.User).filter_by(username="admin").one()
+        db.query(models.UserPermission).filter_by(user_id=admin.id).update({"permission_id": 2})
+        admin.permissions_version += 1
+        db.commit()
+
+    class Later:
+        @staticmethod
+        def monotonic():
+            return time.monotonic() + cache.PERMISSION_VERSION_TTL + cache.PRINCIPAL_CACHE_TTL
+
+    monkeypatch.setattr(cache, "time", Later)
+    assert test_client.get("/counters/", headers=headers).status_code == 403
+
+def test_principal_is_resolved_in_one_statement(test_client):
+    access_token = authenticate_admin(test_client)
+    principal_cache.clear()
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def resolve_principal():
+        async with AsyncSessionLocal() as db:
+            return await service.get_current_user(db, access_token)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record_statement)
+    try:
+        principal = test_client.portal.call(resolve_principal)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record_statement)
+    assert principal.username == "admin"
+    assert principal.permissions == {1}
+    assert len(statements) == 1
+
+def test_list_users_cursor_pagination(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    first_page = test_client.get("/list_users/", headers=headers, params={"limit": 2})
+    assert [user["username"] for user in first_page.json()] == ["admin", "JackDoe"]
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = test_client.get("/list_users/", headers=headers, params={"limit": 2, "cursor": cursor})
+    assert [user["username"] for user in second_page.json()] == ["HarryDoe"]
+    assert "X-Next-Cursor" not in second_page.headers
+
+def test_list_users_invalid_cursor(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = test_client.get("/list_users/", headers=headers, params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    cursor = service.encode_cursor(1)
+    response = test_client.get("/list_users/", headers=headers, params={"cursor": cursor, "skip": 1})
+    assert response.status_code == 400
+
+def test_list_users_filter_matches_wildcards_literally(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    for term in ("%", "_", "J%n"):
+        response = test_client.get("/list_users/", headers=headers, params={"name": term})
+        assert response.status_code == 200
+        assert response.json() == []
+    response = test_client.get("/list_users/", headers=headers, params={"email": "ARRY@"})
+    assert [user["username"] for user in response.json()] == ["HarryDoe"]
+
+def test_list_users_total_count(test_client, monkeypatch):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = test_client.get("/list_users/", headers=headers, params={"limit": 1, "include_total": True})
+    assert response.headers["X-Total-Count"] == "3"
+    assert response.headers["X-Total-Count-Exact"] == "true"
+    response = test_client.get("/list_users/", headers=headers, params={"name": "harry", "include_total": True})
+    assert response.headers["X-Total-Count"] == "1"
+    assert "X-Total-Count" not in test_client.get("/list_users/", headers=headers).headers
+
+    test_client.post(
+        "/create_user",
+        headers=headers,
+        json={"email": "harriet@example.com", "password": "G*qE/6r$", "username": "harriet", "name": "Harriet", "surname": "Doe", "permissions": [2]}
+    )
+    monkeypatch.setattr(service, "EXACT_COUNT_LIMIT", 1)
+    response = test_client.get("/list_users/", headers=headers, params={"name": "harr", "include_total": True})
+    assert response.headers["X-Total-Count"] == "2"
+
+    # Another worker's create only reaches this one through the shared page cache generation.
+    with TestingSessionLocal() as db:
+        db.add(models.User(username="harrison", name="Harrison", surname="Doe", email="harrison@example.com",
+                           password="x"))
+        db.commit()
+    response = test_client.get("/list_users/", headers=headers, params={"name": "harr", "include_total": True})
+    assert response.headers["X-Total-Count"] == "2"
+    test_client.portal.call(page_cache.invalidate)
+    response = test_client.get("/list_users/", headers=headers, params={"name": "harr", "include_total": True})
+    assert response.headers["X-Total-Count"] == "3"
+
+def test_export_users_ndjson_and_csv(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = test_client.get("/export_users/", headers=headers, params={"surname": "doe"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["username"] for row in rows] == ["admin", "JackDoe", "HarryDoe"]
+    assert "password" not in rows[0]
+    response = test_client.get("/export_users/", headers=headers, params={"format": "csv", "limit": 1})
+    assert response.text.splitlines() == ["id,username,name,surname,email", "1,admin,John,Doe,admin@example.com"]
+
+def test_list_users_limit_is_capped(test_client):
+    access_token = authenticate_admin(test_client)
+    response = test_client.get(
+        "/list_users/",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"limit": 100_000}
+    )
+    assert response.status_code == 422
+
+def test_create_users_batch(test_client):
+    access_token = authenticate_admin(test_client)
+    new_user = {"password": "G*qE/6r$", "name": "test", "surname": "user", "permissions": [2]}
+    response = test_client.post(
+        "/create_users",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json=[
+            {**new_user, "email": "batch1@example.com", "username": "batch1"},
+            {**new_user, "email": "harry@example.com", "username": "batch2"},
+            {**new_user, "email": "batch3@example.com", "username": "batch1"},
+            {**new_user, "email": "batch4@example.com", "username": "batch4", "permissions": [2, 99]},
+            {**new_user, "email": "batch5@example.com", "username": "batch5", "permissions": [1, 1]},
+        ]
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+    assert results[0]["user"]["username"] == "batch1"
+    assert results[1]["error"] == "Email already registered"
+    assert results[2]["error"] == "Username repeated in batch"
+    assert results[3]["error"] == "Unknown permissions: [99]"
+    assert results[4]["user"]["username"] == "batch5"
+    login_response = test_client.post("/token", data={"username": "batch5", "password": "G*qE/6r$"})
+    assert login_response.status_code == 200
+
+def test_create_users_batch_requires_admin(test_client):
+    login_response = test_client.post("/token", data={"username": "HarryDoe", "password": "G*qE/6r$"})
+    response = test_client.post(
+        "/create_users",
+        headers={"Authorization": f"Bearer {login_response.json()['access_token']}"},
+        json=[]
+    )
+    assert response.status_code == 403
+
+def test_create_user_duplicate_email_and_username(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    new_user = {"password": "G*qE/6r$", "name": "test", "surname": "user", "permissions": [1]}
+    response = test_client.post("/create_user", headers=headers,
+                                json={**new_user, "email": "harry@example.com", "username": "testuser"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+    response = test_client.post("/create_user", headers=headers,
+                                json={**new_user, "email": "testuser@example.com", "username": "HarryDoe"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already registered"
+    response = test_client.post("/create_user", headers=headers,
+                                json={**new_user, "email": "testuser@example.com", "username": "testuser"})
+    assert response.status_code == 200
+
+def test_duplicate_username_containing_email(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    new_user = {"password": "G*qE/6r$", "name": "test", "surname": "user", "permissions": [1]}
+    response = test_client.post("/create_user", headers=headers,
+                                json={**new_user, "email": "fan1@example.com", "username": "emailfan"})
+    assert response.status_code == 200
+    response = test_client.post("/create_user", headers=headers,
+                                json={**new_user, "email": "fan2@example.com", "username": "emailfan"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already registered"
+
+    # PostgreSQL puts the rejected value in the message; the constraint name decides.
+    class Diag:
+        constraint_name = "ix_users_username"
+
+    class UniqueViolation(Exception):
+        diag = Diag()
+
+    orig = UniqueViolation('duplicate key value violates unique constraint "ix_users_username"\n'
+                           'DETAIL:  Key (username)=(emailfan) already exists.')
+    assert repository._duplicate_user_field(IntegrityError("INSERT", {}, orig)) == "username"
+
+def test_counters_are_shared_through_the_database(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    before = test_client.get("/counters/", headers=headers).json()
+    test_client.get("/list_users/", headers=headers)
+    test_client.get("/list_users/", headers=headers)
+    api_counters.increment("background_ticks")
+    test_client.portal.call(api_counters.flush)
+    after = test_client.get("/counters/", headers=headers).json()
+    assert after["list_users_calls"] == before["list_users_calls"] + 2
+    assert after["background_ticks"] == before["background_ticks"] + 1
+    assert after["create_user_calls"] == before["create_user_calls"]
+    with TestingSessionLocal() as db:
+        stored = db.get(models.ApiCounter, "list_users_calls")
+    assert stored.value == after["list_users_calls"]
+
+def test_cancelled_counter_flush_keeps_deltas():
+    class BlockingSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+        async def execute(self, statement):
+            await asyncio.Event().wait()
+
+    async def cancel_flush():
+        counters = ApiCounters(session_factory=BlockingSession)
+        counters.increment("list_users_calls", 2)
+        flush = asyncio.create_task(counters.flush())
+        await asyncio.sleep(0)
+        flush.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await flush
+        return counters
+
+    counters = asyncio.run(cancel_flush())
+    assert counters._pending == {"list_users_calls": 2}
+    assert not counters._flushing
+
+def test_metrics_expose_route_latency_histograms(test_client):
+    access_token = authenticate_admin(test_client)
+    test_client.get("/list_users/?limit=1", headers={"Authorization": f"Bearer {access_token}"})
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'app_http_request_duration_seconds_count{method="POST",route="/token",status="200"}' in response.text
+    assert 'app_http_request_duration_seconds_count{method="GET",route="/list_users/",status="200"}' in response.text
+    assert 'app_http_request_db_seconds_count{method="GET",route="/list_users/"}' in response.text
+    assert 'app_bcrypt_duration_seconds_count{operation="verify"}' in response.text
+    db_seconds = next(line for line in response.text.splitlines()
+                      if line.startswith('app_http_request_db_seconds_sum{method="GET",route="/list_users/"}'))
+    assert float(db_seconds.split()[-1]) > 0
+    assert 'app_db_pool_checkout_seconds_count{pool="async"}' in response.text
+    assert 'app_db_pool_checked_out{pool="async"}' in response.text
+
+def test_list_users_returns_only_public_columns(test_client):
+    access_token = authenticate_admin(test_client)
+    response = test_client.get("/list_users/?limit=1", headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == [
+        {"id": 1, "username": "admin", "name": "John", "surname": "Doe", "email": "admin@example.com"}
+    ]
+
+def test_list_users_pages_are_cached_until_a_user_is_created(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    first = test_client.get("/list_users/?name=test", headers=headers)
+    second = test_client.get("/list_users/?name=TEST", headers=headers)
+    assert first.json() == second.json() == []
+    assert page_cache.stats()["hits"] == 1
+    test_client.post(
+        "/create_user",
+        headers=headers,
+        json={"email": "testuser@example.com", "password": "G*qE/6r$", "username": "testuser", "name": "test", "surname": "user", "permissions": [1]}
+    )
+    third = test_client.get("/list_users/?name=test", headers=headers)
+    assert [user["username"] for user in third.json()] == ["testuser"]
+
+def test_admin_profile_header_returns_server_timing_and_profile(test_client):
+    access_token = authenticate_admin(test_client)
+    response = test_client.get("/list_users/", headers={"Authorization": f"Bearer {access_token}", "X-Profile": "1"})
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert timing.startswith('db;dur=') and "auth;dur=" in timing and "total;dur=" in timing
+    assert 'desc="0 statements"' not in timing
+    path = os.path.join(profiling.PROFILE_DIR, response.headers["x-profile-file"])
+    try:
+        assert pstats.Stats(path).total_calls > 0
+    finally:
+        os.remove(path)
+        if not os.listdir(profiling.PROFILE_DIR):
+            os.rmdir(profiling.PROFILE_DIR)
+
+def test_profile_header_is_ignored_for_non_admins(test_client):
+    login_response = test_client.post("/token", data={"username": "HarryDoe", "password": "G*qE/6r$"})
+    access_token = login_response.json()["access_token"]
+    response = test_client.get("/counters/", headers={"Authorization": f"Bearer {access_token}", "X-Profile": "1"})
+    assert "server-timing" not in response.headers
+    assert "x-profile-file" not in response.headers
+
+def test_every_endpoint_has_a_query_budget():
+    endpoints = {(method, route.path) for route in app.routes if isinstance(route, APIRoute) for method in route.methods}
+    assert endpoints <= set(QUERY_BUDGETS)
+
+@pytest.mark.query_budget(0)
+def test_query_budget_fails_requests_over_budget(test_client):
+    with pytest.raises(pytest.fail.Exception, match=r"POST /token ran \d+ SQL statements, budget is 0"):
+        authenticate_admin(test_client)
+
+def test_logout_revokes_only_the_used_token(test_client):
+    revoked_token = authenticate_admin(test_client)
+    other_token = authenticate_admin(test_client)
+    assert jwt.get_unverified_claims(revoked_token)["jti"] != jwt.get_unverified_claims(other_token)["jti"]
+    assert test_client.get("/counters/", headers={"Authorization": f"Bearer {revoked_token}"}).status_code == 200
+    response = test_client.post("/logout", headers={"Authorization": f"Bearer {revoked_token}"})
+    assert response.status_code == 204
+    assert test_client.get("/counters/", headers={"Authorization": f"Bearer {revoked_token}"}).status_code == 401
+    assert test_client.post("/logout", headers={"Authorization": f"Bearer {revoked_token}"}).status_code == 401
+    assert test_client.get("/counters/", headers={"Authorization": f"Bearer {other_token}"}).status_code == 200
+
+def test_revocations_from_other_workers_are_picked_up_on_refresh(test_client):
+    access_token = authenticate_admin(test_client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert test_client.get("/counters/", headers=headers).status_code == 200
+    claims = jwt.get_unverified_claims(access_token)
+    with TestingSessionLocal() as db:
+        db.add(models.RevokedToken(jti=claims["jti"], expires_at=claims["exp"]))
+        db.add(models.RevokedToken(jti="expired", expires_at=1))
+        db.commit()
+    test_client.portal.call(revoked_tokens.refresh)
+    assert test_client.get("/counters/", headers=headers).status_code == 401
+    test_client.portal.call(revoked_tokens.prune)
+    with TestingSessionLocal() as db:
+        assert [token.jti for token in db.query(models.RevokedToken)] == [claims["jti"]]
@@ -0,0 +1,48 @@
+import os
+import subprocess
+from app.metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry(directory=None)
+    family = registry.histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+    family.labels("/a").observe(0.05)
+    family.labels("/a").observe(0.5)
+    family.labels("/a").observe(5)
+    text = registry.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in text
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'test_seconds_count{route="/a"} 3' in text
+    assert 'test_seconds_sum{route="/a"} 5.55' in text
+
+def test_render_sums_other_workers_snapshots(tmp_path):
+    other = MetricsRegistry(directory=str(tmp_path))
+    other.histogram("test_seconds", "Test.", ("route",), buckets=(1.0,)).labels("/a").observe(0.5)
+    other.write_snapshot()
+    os.replace(tmp_path / f"metrics-{os.getpid()}.json", tmp_path / "metrics-1.json")
+
+    registry = MetricsRegistry(directory=str(tmp_path))
+    family = registry.histogram("test_seconds", "Test.", ("route",), buckets=(1.0,))
+    family.labels("/a").observe(2.0)
+    family.labels("/b").observe(0.5)
+    text = registry.render()
+    assert 'test_seconds_count{route="/a"} 2' in text
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 1' in text
+    assert 'test_seconds_count{route="/b"} 1' in text
+
+def test_render_drops_gauges_of_exited_workers(tmp_path):
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    other = MetricsRegistry(directory=str(tmp_path))
+    other.counter("test_total", "Test.").labels().inc(3)
+    other.gauge("test_open", "Test.").add_callback(lambda: {(): 2})
+    other.write_snapshot()
+    os.replace(tmp_path / f"metrics-{os.getpid()}.json", tmp_path / f"metrics-{exited.pid}.json")
+
+    registry = MetricsRegistry(directory=str(tmp_path))
+    registry.counter("test_total", "Test.").labels().inc(1)
+    registry.gauge("test_open", "Test.").add_callback(lambda: {(): 1})
+    text = registry.render()
+    assert "test_total 4" in text
+    assert "test_open 1" in text